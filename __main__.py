@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Command line entry point (see src/spectra_Batch.py):
+
+    python -m spectra [options]
+"""
+
+import sys
+
+from .src.spectra_Batch import main
+
+sys.exit(main())
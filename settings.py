@@ -9,6 +9,39 @@ parameters = {
     #Set to False only if not installed or supported, but some functionalities might be compromised.
     'use_pickle'    :   True,
 
+    #Keep a binary copy of the parsed data files in load/cache, so that unchanged files aren't parsed again.
+    'use_cache'     :   True,
+
+    #Number of worker processes used to import the data files. 1 means serial, 0 means as many as CPU cores.
+    'processes'     :   1,
+
+    #Pack every isotope, element and compound spectrum into a single file (load/spectra.bin) that is memory-mapped.
+    #Saved catalogs then point at it, so that processes working on the same node share it instead of copying it.
+    'use_store'     :   False,
+
+    #Save the catalog as one record per substance plus a manifest (load/catalog) instead of a single spcat.pickle.
+    #Only changed substances are written on save, and substances are only read when they are needed.
+    'use_shards'    :   True,
+
+    #Lazy catalog: files are imported and peaks computed only when a substance is used for the first time.
+    'lazy'          :   False,
+
+    #Read data files in chunks, keeping only the energy region (e_min, e_max) plus roi_margin
+    #mesh points at each side. Keep roi_margin above prangemax so that peaks at the edges can still be bounded.
+    'stream_roi'    :   False,
+    'roi_margin'    :   1000,
+
+    #Keep the peaks computed with every set of peak detection settings, so that recomputing a substance with a set
+    #that has already been used doesn't compute them again. Up to peak_cache_mb megabytes are kept in memory (the
+    #least recently used go first; 0 disables it). With peak_cache_disk, they are also kept in load/peakcache,
+    #up to peak_cache_mb megabytes as well.
+    'peak_cache_mb' :   64,
+    'peak_cache_disk':  False,
+
+    #Never stop on a prompt: every question takes its default answer and no catalog is built on import.
+    #Also set by the SPECTRA_BATCH environment variable. The command line entry point (python -m) is always unattended.
+    'batch'         :   False,
+
     #Ask mode (n-tot, n-g) when looking for isotopes in the finder.
     'ask_mode'      :   False,
 
@@ -4,6 +4,7 @@ from tqdm import tqdm
 from datetime import datetime
 import time
 import shutil
+from math import comb
 
 import numpy as np
 import scipy.integrate as spint
@@ -44,32 +45,33 @@ def InterpretName(name):
 
 def IndMaxima(arr,s=1):
     """Takes an array and looks for the indices that correspond either to local maxima or to local minima
+    A plateau (run of equal values) that is a local extremum gives all of its indices.
     inputs:
-        - arr: numpy array to consider
+        - arr: numpy array to consider. If it has two axes, every row is a spectrum of its own.
         - s:    1: means local maxima
                -1: means local minima
     outputs:
-        - iextr: array of local extrema (maxima or minima) indices"""
-    dersgn = np.zeros((len(arr)-1))
-    iextr = np.empty((0),dtype=np.int64)
-    for i in range(len(arr)-1):
-        dersgn[i] = np.sign(arr[i+1]-arr[i])
-    for i in range(0,len(arr)-2):
-        if dersgn[i] == s and dersgn[i+1] == -s:
-            iextr = np.append(iextr,i+1)
-        if dersgn[i] == s and dersgn[i+1] == 0:
-            for j in range(i+1, len(arr)-1):
-                if dersgn[j] != 0:
-                    if dersgn[j] == -s:
-                        iextr = np.append(iextr,np.arange(i+1,j+1))
-                    break
-    return iextr
+        - iextr: array of local extrema (maxima or minima) indices (list of arrays, one per row, if 2-D)"""
+    arr = np.asarray(arr)
+    if arr.ndim > 1: return [IndMaxima(row, s) for row in arr]
+    dersgn = np.sign(np.diff(arr))
+    # Plateaus are skipped: only the derivative signs that aren't zero are compared (nan isn't zero, either)
+    inz = np.flatnonzero(dersgn != 0)
+    k = np.flatnonzero((dersgn[inz[:-1]] == s) & (dersgn[inz[1:]] == -s))
+    # Every extremum spans from the point after the rise to the one where it falls.
+    starts, ends = inz[k]+1, inz[k+1]+1
+    lengths = ends - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return (np.arange(np.sum(lengths)) + offsets).astype(np.int64)
 
 # A couple little functions to ask for parameters. Just for code reusability's sake.
+def Ask(question, default=''):
+    """Same as input(question), but the default answer is given back without asking in batch mode (cf.batch)."""
+    return default if cf.batch else input(question)
 def AskAxis():
-    return True if input('x-axis: (1 eV; [2] ToF) >').lower() in ['1','ev'] else False
+    return True if Ask('x-axis: (1 eV; [2] ToF) >').lower() in ['1','ev'] else False
 def AskLim():
-    return True if input('Show detection limits? ([y]/n) >').lower() not in ['n','no'] else False
+    return True if Ask('Show detection limits? ([y]/n) >').lower() not in ['n','no'] else False
 
 def GetIndex(arr,elements,single_as_int=True):
     """Given an array and an element of it, gives back the index array where the element is found.
@@ -87,11 +89,22 @@ def GetIndex(arr,elements,single_as_int=True):
             index/indices of elements in arr
     Warnings:
         - if the element occurs more than once in the array, the first indexs is returned.
-        - if the element doesn't belong to the array, returns None"""
+        - if the element doesn't belong to the array, raises IndexError."""
     outp = None
-    if type(elements) in [int,float,np.float_]: elements = np.array([elements])
-    if type(elements) in [list,tuple]: elements = np.array(elements)
-    outp = np.array([np.nonzero(arr==el)[0][0] for el in elements])
+    arr = np.asarray(arr)
+    elements = np.atleast_1d(np.asarray(elements))
+    if np.size(elements) == 0: return np.array([])
+
+    # Binary search: straight on arr if it is increasing, else on its unique values (which are sorted and
+    # remember the index of their first occurrence).
+    if np.size(arr) < 2 or np.all(arr[1:] >= arr[:-1]):
+        keys, first = arr, None
+    else:
+        keys, first = np.unique(arr, return_index=True)
+    ikeys = np.minimum(np.searchsorted(keys, elements, 'left'), max(np.size(keys)-1, 0))
+    if np.size(keys) == 0 or not np.all(keys[ikeys] == elements):
+        raise IndexError('GetIndex: element not found in the array')
+    outp = ikeys if first is None else first[ikeys]
     if not outp is None and np.size(outp) == 1 and single_as_int: outp = outp[0]
     return outp
 
@@ -112,13 +125,67 @@ def InBetween(arr,val,outp_i=False):
     Warning:
         - if the element is below the minimum value of the array or above the maximum, returns a
             (2,)-shaped ndarray of None.
+        - if the array isn't ordered, the first pair of consecutive elements that 'sandwich' the value is taken.
+            For many values in an ordered array, Brackets is much faster.
             """
     if val in arr: return np.array([val,val]) if not outp_i else GetIndex(arr,np.array([val,val]))
-    for i in range(len(arr)-1):
-        if val>arr[i] and val<arr[i+1] or val<arr[i] and val>arr[i+1]:
-            return np.array([arr[i],arr[i+1]]) if not outp_i else np.array([i,i+1])
+    arr = np.asarray(arr)
+    lower, upper = arr[:-1], arr[1:]
+    isides = np.flatnonzero((val>lower) & (val<upper) | (val<lower) & (val>upper))
+    if np.size(isides) > 0:
+        i = isides[0]
+        return np.array([arr[i],arr[i+1]]) if not outp_i else np.array([i,i+1])
     return np.array([None,None])
 
+def Brackets(arr,vals,outp_i=False,missing=None):
+    """Same as InBetween for many values at once, by binary search. The array must be monotonic (either
+    increasing or decreasing, as spectra axes are).
+    inputs:
+        - arr (np.ndarray):
+            monotonic numpy array to be searched in
+        - vals (int, float, list, tuple, np.ndarray):
+            elements to 'sandwich' in arr
+        - outp_i (bool):
+            True: the indices of the elements that 'sandwich' every value are returned.
+            False: the actual elements that 'sandwich' every value are returned
+        - missing:
+            what values below the minimum value of the array or above the maximum give: None, as in InBetween,
+            unless something numeric (e.g. -1 or nan) is given, so that the output is a numeric array.
+    outputs:
+        - (M,2)-shaped ndarray with a row per value, equal to what InBetween gives back for it (an exact
+            match gives the index of its first occurrence twice).
+    Warning:
+        - if some value is out of the array range and missing is None, the output is an array of objects."""
+    arr = np.asarray(arr)
+    vals = np.atleast_1d(np.asarray(vals))
+    n = np.size(arr)
+    desc = n > 1 and arr[0] > arr[-1]
+    warr = arr[::-1] if desc else arr
+
+    # First occurrence of exact matches (the last one in the reversed array if decreasing)
+    iexact = np.searchsorted(warr, vals, 'right')-1 if desc else np.searchsorted(warr, vals, 'left')
+    exact = (iexact >= 0) & (iexact < n)
+    exact[exact] = warr[iexact[exact]] == vals[exact]
+
+    ileft = np.searchsorted(warr, vals, 'left')
+    inside = (ileft > 0) & (ileft < n) & ~exact
+    ileft = np.where(desc, n-1-ileft, ileft-1) if n > 0 else ileft
+    iexact = np.where(desc, n-1-iexact, iexact)
+
+    isides = np.full((np.size(vals),2), -1, dtype=np.int64)
+    isides[inside] = np.column_stack((ileft[inside], ileft[inside]+1))
+    isides[exact] = iexact[exact,None]
+    found = isides[:,0] >= 0
+    if outp_i:
+        sides = isides
+    else:
+        sides = np.full(np.shape(isides), np.nan)
+        sides[found] = arr[isides[found]]
+    if found.all(): return sides
+    if missing is None: sides = sides.astype(object)
+    sides[~found] = missing
+    return sides
+
 def Closest(arr,val,outp_i=False):
     """Given an ordered array and a value, returns the closest element of the array to the value.
     inputs:
@@ -138,6 +205,29 @@ def Closest(arr,val,outp_i=False):
     res = sides[np.argmin(np.abs(sides-val))]
     return res if not outp_i else GetIndex(arr,res)
 
+def ClosestMany(arr,vals,outp_i=False,missing=None):
+    """Same as Closest for many values at once, by binary search (see Brackets). The array must be monotonic.
+    outputs:
+        - (M,)-shaped ndarray with either the closest elements or their indices (first occurrence).
+    Warning:
+        - values below the minimum value of the array or above the maximum give missing: None, as in Closest,
+            unless something numeric is given (then the output is an array of objects if there are any)."""
+    arr = np.asarray(arr)
+    vals = np.atleast_1d(np.asarray(vals))
+    sides = Brackets(arr, vals, False, np.nan)
+    found = ~np.isnan(sides[:,0])
+    # Ties go to the first side, as np.argmin does.
+    upper = np.abs(sides[:,1]-vals) < np.abs(sides[:,0]-vals)
+    res = np.where(upper, sides[:,1], sides[:,0])
+    if outp_i:
+        ires = np.full(np.shape(res), -1, dtype=np.int64)
+        ires[found] = Brackets(arr, res[found], True)[:,0]
+        res = ires
+    if found.all(): return res
+    if missing is None: res = res.astype(object)
+    res[~found] = missing
+    return res
+
 def Chunk(arr,tup):
     """Given an ordered array and a tuple of values, gives the array that is best bounded by the
     values in the tuple.
@@ -151,8 +241,7 @@ def Chunk(arr,tup):
         - np.array with the same number of dimensions as the input one, bounded by elements in tup."""
     layers = np.shape(arr)[0] > 1
     warr = arr[0] if layers else arr[:]
-    imin = Closest(warr,tup[0],1)
-    imax = Closest(warr,tup[1],1)
+    imin, imax = ClosestMany(warr,tup,True)
     return np.vstack(warr[:,imin:imax+1]) if layers else warr[imin:imax+1]
 
 def Smooth(arr,it):
@@ -166,21 +255,45 @@ def Smooth(arr,it):
     outputs:
         - smoothed array"""
     if len(np.shape(arr)) > 1:
-        arr0 = np.copy(arr)[1]
+        arr0 = SmoothRows(np.copy(arr)[1],it)
     else:
-        arr0 = np.copy(arr)
-    for j in range(it):
-        temp = [0.]
-        for i in range(1,np.size(arr0)-1):
-            temp.append((arr0[i-1]+2*arr0[i]+arr0[i+1])/4)
-        temp.append(0.)
-        arr0 = np.copy(np.array(temp))
+        arr0 = SmoothRows(arr,it)
     if len(np.shape(arr)) > 1 and np.shape(arr)[0] > 1:
         arr0 = [arr[0],arr0]
         for i in range(2,np.shape(arr)[0]):
             arr0.append(arr[i])
     return np.array(arr0)
 
+def SmoothRows(arr,it):
+    """Smooths every row of an array of y values (a stack of equally sized spectra) it times with the
+    {1 2 1}/4 mesh, setting the endpoints to zero in every iteration, as Smooth does.
+    The first iteration is the only one that sees the actual endpoints. The rest are applied at once, as a
+    single binomial kernel over the odd periodic extension of the rows (which keeps the endpoints at zero).
+    inputs:
+        - arr: (np.ndarray):
+            numpy array (1-D or 2-D) to smooth along its last axis.
+        -it: (int)
+            number of iterations
+    outputs:
+        - smoothed array of the same shape"""
+    if it < 1: return np.copy(arr)
+    arr = np.asarray(arr, dtype=float)
+    n = np.shape(arr)[-1]
+    arr0 = np.zeros(np.shape(arr))
+    if n < 3: return arr0
+    arr0[...,1:-1] = (arr[...,:-2]+2*arr[...,1:-1]+arr[...,2:])/4
+
+    h = it-1
+    if h == 0: return arr0
+    iext = np.arange(-h, n+h) % (2*(n-1))
+    ext = np.where(iext < n, arr0[...,np.minimum(iext,n-1)], -arr0[...,np.clip(2*(n-1)-iext,0,n-1)])
+    kernel = [comb(2*h,j)/4**h for j in range(2*h+1)]
+    arr0 = kernel[0]*ext[...,:n]
+    for j in range(1,2*h+1):
+        arr0 += kernel[j]*ext[...,j:j+n]
+    arr0[...,0], arr0[...,-1] = 0., 0.
+    return arr0
+
 def FitBoxes(array,dboxes):
     """Forces all the y values of an array to be fit within a made-up mesh of a certain amount of points.
     This amount of points is actually given by as a density, so that num_points = (y_max - y_min)*density
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unattended execution: builds (or updates) the catalog end to end without asking anything, so that it can
+be run as a scheduled job. From the directory above the project:
+
+    python -m spectra [options]
+
+See python -m spectra --help for the options. Run this way, batch is set as soon as the settings are read
+(see spectra_InitSettings.EntryPoint), so spectra_Load, imported with the package, doesn't ask the usual
+"Load catalog from file?" question nor build anything before the options are read.
+"""
+
+import os
+import ast
+import json
+import argparse
+
+from .spectra_InitSettings import cf, err, paths
+
+
+def Run(load=False, samples=True, mixes=True, mix_out=False, export=True, save=True, match=False, tolerance=None, match_format='csv', lazy=None):
+    """Runs the whole import in batch mode (every question takes its default answer, see basics.Ask).
+    inputs:
+        - load: bool
+            True: the saved catalog (shards or spcat.pickle) is updated if there is one.
+            False: the catalog is built from scratch.
+        - samples: bool
+            import samples (only the new ones if the catalog has been loaded).
+        - mixes: bool
+            import the mixes in input/Natural_in.txt and input/Compound_in.txt.
+        - mix_out: bool
+            write input/Natural_out.txt and input/Compound_out.txt.
+        - export: bool
+            write the peak properties files (see Catalog.export).
+        - save: bool
+            save the catalog (see Catalog.save).
+        - match: bool
+            match the maxima of every sample against the peaks of the catalog and export the candidates
+            (see spectra_ObjectsFunc.MatchAll and spectra_FileHandlers.ExportMatches).
+        - tolerance: float
+            matching tolerance, in us (cf.max_match if None).
+        - match_format: 'csv' or 'npy'
+            format of the exported candidates.
+        - lazy: bool
+            hold the substances as Proxy instances (see Catalog). cf.lazy if None.
+    output:
+        - the Catalog instance"""
+    from .spectra_Objects import Catalog
+    from .spectra_FileHandlers import pload, sload, ShardsExist, ExportMatches
+
+    if lazy is None: lazy = cf.lazy
+    batch, cf.batch = cf.batch, True
+    try:
+        assert paths.isd('data'), 'Missing directory: {}'.format(paths.data)
+        for d in ['output', 'input', 'load']:
+            if not paths.isd(d): os.makedirs(paths.path(d))
+
+        shards = cf.use_shards and ShardsExist()
+        if load and (shards or paths.isfx('spcat.pickle', 'load')):
+            print('Updating catalog from file.')
+            spcat = sload(lazy) if shards else pload()
+            err.start()
+            if samples: spcat.sample_in()
+            if mixes: spcat.mix_in()
+            err.present()
+        else:
+            print('Building catalog.')
+            spcat = Catalog(samples=samples, mixes=mixes, lazy=lazy)
+
+        if mix_out: spcat.mix_out()
+        if export: spcat.export()
+        if match: ExportMatches(spcat.pmatchall(distmax=tolerance), match_format)
+        if save: spcat.save()
+    finally:
+        cf.batch = batch
+    return spcat
+
+
+def ParseValue(value):
+    """Settings given in the command line are python literals (1e3, (20, 2000), 'n-g'...) or plain strings."""
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+
+def ParseArgs(argv=None):
+    parser = argparse.ArgumentParser(prog='spectra', description='Unattended catalog import, peak computation and export.')
+    parser.add_argument('-c', '--config', help='JSON file with "settings" and "paths" dictionaries and any of the options below '
+                        '(e.g. {"settings": {"processes": 4}, "load": true}). Command line options override it.')
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='KEY=VALUE', help='override a setting of settings.py')
+    parser.add_argument('-p', '--path', action='append', default=[], metavar='KEY=DIR', help='override a directory of paths.py')
+    parser.add_argument('-j', '--processes', type=int, help='worker processes for the import (0: as many as CPU cores)')
+    parser.add_argument('--load', action='store_true', default=None, help='update the saved catalog instead of building it again')
+    parser.add_argument('--no-samples', dest='samples', action='store_false', default=None, help="don't import samples")
+    parser.add_argument('--no-mixes', dest='mixes', action='store_false', default=None, help="don't import mixes")
+    parser.add_argument('--mix-out', action='store_true', default=None, help='write the mix templates to the input directory')
+    parser.add_argument('--no-export', dest='export', action='store_false', default=None, help="don't export peak properties")
+    parser.add_argument('--no-save', dest='save', action='store_false', default=None, help="don't save the catalog")
+    parser.add_argument('--match', action='store_true', default=None, help='match the maxima of every sample against the catalog '
+                        'and export the candidates to the output directory')
+    parser.add_argument('--tolerance', type=float, help='matching tolerance in us (default: max_match of settings.py)')
+    parser.add_argument('--match-format', choices=['csv', 'npy'], help='format of the exported candidates (default: csv)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = ParseArgs(argv)
+
+    config = dict()
+    if args.config:
+        with open(args.config, 'r') as iFile:
+            config = json.load(iFile)
+
+    settings = dict(config.get('settings', dict()))
+    settings.update({key: ParseValue(value) for key, value in (el.split('=', 1) for el in args.set)})
+    if args.processes is not None: settings['processes'] = args.processes
+    cf.update(**settings)
+
+    dirs = dict(config.get('paths', dict()))
+    dirs.update(dict(el.split('=', 1) for el in args.path))
+    for key in dirs:
+        setattr(paths, key, os.path.abspath(os.path.expanduser(dirs[key])))
+
+    options = dict()
+    for key in ['load', 'samples', 'mixes', 'mix_out', 'export', 'save', 'match', 'tolerance', 'match_format']:
+        value = getattr(args, key)
+        options[key] = config[key] if value is None and key in config else value
+    Run(**{key: options[key] for key in options if options[key] is not None})
+    return 0
@@ -1,4 +1,13 @@
 import os
+import re
+import json
+import pickle
+import functools
+import hashlib
+import weakref
+from collections import OrderedDict
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 from datetime import datetime
 import time
@@ -14,7 +23,17 @@ from .spectra_InitSettings import cf, peakattr, err, paths
 
 file_peaks_human = 'PeakProperties.txt'
 file_peaks_nonhuman = 'peakprops.txt'
+file_peaks_bin = 'peakprops.npz'
+file_matches = 'matches'
 file_pickle = 'spcat.pickle'
+dir_cache = 'cache'
+file_cache_index = 'index.json'
+file_store = 'spectra.bin'
+file_store_index = 'spectra_index.json'
+dir_shards = 'catalog'
+dir_peakcache = 'peakcache'
+file_manifest = 'manifest.json'
+shard_attrs = ('fullname', 'kind', 'mode', 'npeaks')
 
 ans_yes = ['yes', 'Yes', 'y', 'Y', 'YES', 1, '1']
 ans_no = ['no', 'No', 'n', 'N', 'NO', 0, '0']
@@ -44,6 +63,271 @@ def pload():
     return data
 
 
+def ShardsPath(*args):
+    return os.path.join(paths.join('load', dir_shards), *args)
+
+
+def ShardsExist():
+    return os.path.isfile(ShardsPath(file_manifest))
+
+
+def ShardInfo(subs):
+    """Cheap attributes of a substance that are kept in the manifest, so that they are known without loading it."""
+    info = {attr: getattr(subs, attr) for attr in shard_attrs}
+    info['npeaks'] = int(info['npeaks'])
+    if info['kind'] == 'sample': info['filename'] = subs.filename
+    return info
+
+
+def LoadShard(filepath):
+    """Loads a single substance record. It is clean (not dirty) as it is the same as on disk."""
+    with open(filepath, 'rb') as f:
+        subs = pickle.load(f)
+    subs.dirty = False
+    return subs
+
+
+def ssave(self):
+    """This is a method.
+    Method that saves the catalog as shards: one pickle record per substance plus a manifest, in load/catalog.
+    Only the substances that are dirty (created, recomputed or edited since they were loaded) are written.
+    Records of substances that aren't in the catalog anymore are removed.
+    input:
+        - self: catalog instance"""
+    from .spectra_Objects import Proxy
+    assert cf.use_pickle, "Pickle isn't activated"
+    manifest = dict(date_created=self.date_created, date_modified=self.date_modified, volumes=dict())
+    written = 0
+    for volume in self.volumes:
+        os.makedirs(ShardsPath(volume), exist_ok=True)
+        manifest['volumes'][volume] = dict()
+        for name, subs in getattr(self, volume).items():
+            record = os.path.join(volume, name.replace(os.sep, '_') + '.pickle')
+            if isinstance(subs, Proxy) and subs.target() is None and subs.origin == ShardsPath(record):
+                # Not loaded since it was read from this very record: nothing to write.
+                target = None
+            else:
+                target = subs.load() if isinstance(subs, Proxy) else subs
+            if not target is None and (target.dirty or not os.path.isfile(ShardsPath(record))):
+                target.dirty = False
+                with open(ShardsPath(record + '.tmp'), 'wb') as f:
+                    pickle.dump(target, f, pickle.HIGHEST_PROTOCOL)
+                os.replace(ShardsPath(record + '.tmp'), ShardsPath(record))
+                written += 1
+            manifest['volumes'][volume][name] = dict(ShardInfo(subs), record=record)
+        # Orphaned records
+        kept = {os.path.basename(info['record']) for info in manifest['volumes'][volume].values()}
+        for f in os.listdir(ShardsPath(volume)):
+            if not f in kept: os.remove(ShardsPath(volume, f))
+    with open(ShardsPath(file_manifest + '.tmp'), 'w') as oFile:
+        json.dump(manifest, oFile)
+    os.replace(ShardsPath(file_manifest + '.tmp'), ShardsPath(file_manifest))
+    print('Catalog saved. {} substance record(s) written.'.format(written))
+    return None
+
+
+def sload(lazy=None):
+    """Function that loads a catalog saved in shards (see ssave).
+    Only the manifest is read: every substance is a Proxy that loads its own record when it is needed.
+    input:
+        - lazy: bool
+            whether the substances imported later on are Proxy instances too (see Catalog). cf.lazy if None.
+    output:
+        - class"""
+    from .spectra_Objects import Catalog, Proxy
+    assert cf.use_pickle, "Pickle isn't activated"
+    with open(ShardsPath(file_manifest), 'r') as iFile:
+        manifest = json.load(iFile)
+    data = Catalog.__new__(Catalog)
+    data.volumes = basics.catalog_volumes
+    data.lazy = cf.lazy if lazy is None else lazy
+    for volume in data.volumes:
+        entries = manifest['volumes'].get(volume, dict())
+        proxies = dict()
+        for name, info in entries.items():
+            record = ShardsPath(info.pop('record'))
+            proxies[name] = Proxy(functools.partial(LoadShard, record), origin=record, **info)
+        setattr(data, volume, proxies)
+    data.date_created, data.date_modified = manifest['date_created'], manifest['date_modified']
+    print('Catalog imported.\nDate of creation: {}\nDate of last modification: {}'.\
+        format(data.date_created, data.date_modified))
+    return data
+
+
+# Patterns used by the bulk parser. They run over the whole file content at once.
+#   - re_data: a line whose first column is numeric (leading '-' and '.' allowed) and has at least another column.
+#   - re_abund: a line starting with a greater than (>) with exactly one colon (:).
+re_data = re.compile(r'^[ \t]*([-.]*\d\S*)[ \t]+(\S+)', re.M)
+re_abund = re.compile(r'^[ \t]*>([^:\n]*):([^:\n]*)$', re.M)
+
+# Translation table that deletes every character a plain block of numbers can be made of.
+numeric_chars = str.maketrans('', '', '0123456789.eE+- \t\r\n')
+
+
+def ParseColumns(text, ncols=2, exact=False):
+    """Bulk parser of the numeric lines in a text. Used by ImportFile (see its docstrings for the format).
+    How it works:
+        - The beginning of the data block is located as the first line that looks like data.
+        - Fast path: if the data block is only made of numbers and every line has the same amount of columns,
+            it is converted in one go. Line ends are marked with a nan sentinel, so that the amount of
+            columns per line can be checked after conversion.
+        - Otherwise, every data line is picked by the re_data pattern and converted at once.
+            Only if this conversion fails, lines are converted one by one and the faulty ones are ignored.
+    input:
+        - text: str
+            content of the file.
+        - ncols: int
+            number of columns to keep (from the left). Lines with less columns are ignored.
+        - exact: bool
+            if True, lines with more than ncols columns are ignored as well.
+    output:
+        - np.ndarray with ncols rows (horizontal), duplicate x values not averaged yet."""
+    first = re_data.search(text)
+    if first is None: return np.empty((ncols,0))
+    body = text[first.start():].rstrip()
+
+    if body.translate(numeric_chars) == '':
+        linecols = len(body.split('\n', 1)[0].split())
+        try:
+            flat = np.array((body.replace('\n', ' nan ') + ' nan').split(), dtype=np.float64)
+        except ValueError:
+            flat = np.empty((0))
+        if (linecols == ncols if exact else linecols >= ncols) and np.size(flat) % (linecols+1) == 0:
+            rows = flat.reshape(-1, linecols+1)
+            if np.isnan(rows[:,-1]).all() and not np.isnan(rows[:,:-1]).any():
+                return rows[:,:ncols].T.copy()
+
+    pattern = re_data.pattern + r'[ \t]+(\S+)'*(ncols-2) + (r'[ \t\r]*$' if exact else '')
+    pattern = re_data if pattern == re_data.pattern else re.compile(pattern, re.M)
+    found = pattern.findall(text)
+    try:
+        rows = np.array(found, dtype=np.float64).reshape(-1, ncols)
+    except ValueError:
+        print('Error produced when converting data to float.')
+        rows = []
+        for line in found:
+            try:
+                rows.append([float(el) for el in line])
+            except ValueError:
+                continue
+        rows = np.array(rows, dtype=np.float64).reshape(-1, ncols)
+    return rows.T
+
+
+def AverageDuplicates(arr):
+    """Averages the consecutive columns of an array sharing the same x value (0th row).
+    Runs of equal x values are found at once. The running mean is then updated for all the runs together,
+    one step per position within the run, so the outcome is exactly the one of averaging line by line.
+    input:
+        - arr: np.ndarray
+            array with x values in the 0th row and any amount of rows to average.
+    output:
+        - np.ndarray of the same amount of rows, with unique consecutive x values."""
+    if np.shape(arr)[1] == 0: return arr
+    starts = np.flatnonzero(np.concatenate(([True], arr[0,1:] != arr[0,:-1])))
+    if np.size(starts) == np.shape(arr)[1]: return arr
+    counts = np.diff(np.append(starts, np.shape(arr)[1]))
+    outp = arr[:,starts]
+    for k in range(1, np.max(counts)):
+        runs = np.flatnonzero(counts > k)
+        outp[1:,runs] = (outp[1:,runs]*k + arr[1:,starts[runs]+k])/(k+1)
+    return outp
+
+
+def CountLines(text):
+    return text.count('\n') + int(len(text) > 0 and not text.endswith('\n'))
+
+
+def Throughput(nlines, elapsed):
+    """Prints the parsing throughput, given the amount of lines and the time (s) spent parsing them."""
+    print('{} lines parsed in {:.2f} s ({:.0f} lines/s).'.format(nlines, elapsed, nlines/max(elapsed, 1e-9)))
+
+
+def ParseFile(file, check=False, ncols=2):
+    """Does the job of ImportFile (see its docstrings) and also gives back the number of lines in the file.
+    output:
+        - np.ndarray with x and y values (horizontal)
+        - abundances dictionary.
+        - int: number of lines read."""
+    with open(file,'r') as iFile:
+        text = iFile.read()
+    nlines = CountLines(text)
+
+    # Perform the checking, if asked to
+    if check and not 'element' in file and not 'compound' in file:
+        wanted_list = basics.InterpretName(file.split('/')[-1].split('.')[0])
+        wanted_isotope = wanted_list[1] + '-' + wanted_list[2]
+        wanted_mode = wanted_list[3]
+        heading = text.split('\n', 1)[0]
+        actual_isotope = heading.split(' ')[0].replace(')','').split('(')[0]
+        actual_mode = heading.split(' ')[0].replace(')','').split('(')[1].replace(',','-')
+        if actual_isotope != wanted_isotope or actual_mode != wanted_mode:
+            print(wanted_isotope,actual_isotope,wanted_mode,actual_mode)
+            print('Isotope error in file:', file)
+            return None,None,nlines
+
+    abund = {key.replace(' ',''): val.replace(' ','') for key,val in re_abund.findall(text)} if '>' in text else dict()
+    return AverageDuplicates(ParseColumns(text, ncols)), abund, nlines
+
+
+def RegionOfInterest():
+    """Region of interest data files are read with, as (xmin, xmax, margin), or None to read them whole.
+    It is given by the energy bounds (cf.xbounds) if cf.stream_roi is set."""
+    if not cf.stream_roi: return None
+    xmin, xmax = cf.xbounds()
+    return (float(xmin), float(xmax), int(cf.roi_margin))
+
+
+def StreamFile(file, xmin, xmax, margin=0, chunksize=1 << 20):
+    """Reads a file with the format of ImportFile (see its docstrings) chunk by chunk, keeping only the points
+    with x in [xmin, xmax] plus margin points at each side (so that peaks at the edges can still be bounded).
+    x values are expected to be increasing. Reading stops as soon as the right margin is complete, and only
+    the current chunk, the last margin points to the left and the kept points are held in memory.
+    input:
+        - file: str
+            whole path to file to import.
+        - xmin, xmax: float
+            region of interest.
+        - margin: int
+            number of points kept at each side of the region of interest.
+        - chunksize: int
+            approximate size (characters) of every chunk read. Chunks always end at the end of a line.
+    output:
+        - np.ndarray with x and y values (horizontal)
+        - abundances dictionary.
+        - int: number of lines read."""
+    kept = []
+    left = np.empty((2,0))
+    started, right, nlines = False, 0, 0
+    abund = dict()
+    with open(file,'r') as iFile:
+        while True:
+            text = iFile.read(chunksize)
+            if text == '': break
+            text += iFile.readline()
+            nlines += CountLines(text)
+            if '>' in text:
+                abund.update({key.replace(' ',''): val.replace(' ','') for key,val in re_abund.findall(text)})
+            arr = ParseColumns(text)
+            i0, i1 = np.searchsorted(arr[0], xmin, 'left'), np.searchsorted(arr[0], xmax, 'right')
+
+            # Points to the left of the region: only the last ones are kept, as a margin.
+            left = np.hstack((left, arr[:,:i0]))[:,max(np.shape(left)[1]+i0-margin, 0):]
+            if i0 == np.shape(arr)[1]: continue
+            if not started:
+                kept.append(left)
+                started = True
+
+            # Points in the region, then up to margin points to the right of it.
+            take = min(margin-right, np.shape(arr)[1]-i1)
+            kept.append(arr[:,i0:i1+take])
+            right += take
+            if i1 < np.shape(arr)[1] and right >= margin: break
+
+    if not started: return np.empty((2,0)), abund, nlines
+    return AverageDuplicates(np.hstack(kept)), abund, nlines
+
+
 def ImportFile(file, check=False):
     """Function that loads a single file of raw data and returns an array of its content.
     Usable for isotope, element, compound and sample files.
@@ -51,14 +335,13 @@ def ImportFile(file, check=False):
         - All the lines starting with a hash (#) will be ignored.
         - All the lines starting with less than two columns will be ignored.
         - Columns are bounded by spaces.
-        - Double spaces will be converted into single spaces.
         - First column corresponds to x values, second column to y values. The rest of them are ignored.
         - All the lines with non-numeric data will be ignored.
         - All lines starting with a greater than (>) will considered to carry information about abundance.
-        - All spaces at the begining or at the end of the line will be removed.
         - There is a feature for Kaeri files that checks that the filename corresponds with the heading.
             This might be inconvenient in case of format change.
-        - Duplicate x values are averaged.
+        - Consecutive duplicate x values are averaged.
+        - The whole file is parsed at once (see ParseColumns and AverageDuplicates), not line by line.
     input:
         - file: str
             whole path to file to import.
@@ -68,138 +351,317 @@ def ImportFile(file, check=False):
     output:
         - np.ndarray with x and y values (horizontal)
         - abundances dictionary. Only appliable to elements and compounds. Empty dictionary otherwise."""
-    xlist,ylist = [],[]
-    with open(file,'r') as iFile:
-        
-        lines = iFile.readlines()
+    return ParseFile(file, check)[:2]
 
-        # Perform the checking, if asked to
-        if check and not 'element' in file and not 'compound' in file:
-            wanted_list = basics.InterpretName(file.split('/')[-1].split('.')[0])
-            wanted_isotope = wanted_list[1] + '-' + wanted_list[2]
-            wanted_mode = wanted_list[3]
-            actual_isotope = lines[0].split(' ')[0].replace(')','').split('(')[0]
-            actual_mode = lines[0].split(' ')[0].replace(')','').split('(')[1].replace(',','-')
-            if actual_isotope != wanted_isotope or actual_mode != wanted_mode:
-                print(wanted_isotope,actual_isotope,wanted_mode,actual_mode)
-                print('Isotope error in file:', file)
-                return None,None
-
-        # lines stores every line in the file.
-        # processed gets filled with the lines of usable data.
-        processed = []
-        abund = dict()
-        for line in lines:
-            if line[0] == "#": continue
-            while line.count('\n') + line.count('  ') != 0: line = line.replace('\n','').replace('  ',' ')
-            while line[0] == ' ': line = line[1:]
-            while line[-1] == ' ': line = line[:-1]
 
-            # Abundance line here.
-            if line[0] == ">":
-                if line.count(':') != 1: continue
-                key,val = line.replace('>','').replace(' ','').split(':')
-                abund[key] = val
-                continue
-            if not line.replace(' ','').replace('-','').replace('.','')[0].isnumeric(): continue
-            if line.count(' ') == 0: continue
+class SpectrumCache:
+    """On-disk cache of parsed spectra, so that unchanged data files don't have to be parsed again.
+    Every parsed array is stored as a .npy file in load/cache. An index file (index.json) keeps, for every
+    source file path, its size, modification time, content hash, abundances and the name of the .npy file.
+    How this works:
+        - An entry is used if the source file has the same size and either the same modification time or
+            the same content hash (hashing is only needed if the file was touched).
+        - Otherwise the entry is stale: the file is parsed and the entry is written again.
+        - On close(), entries whose source file doesn't exist anymore (orphaned) are evicted, as well as
+            .npy files that no entry points at. Then the index is saved.
+    input:
+        - directory: str
+            cache directory. If unspecified (recomended), load/cache."""
+    def __init__(self, directory=None):
+        self.directory = directory or paths.join('load', dir_cache)
+        self.hits, self.misses = 0, 0
+        self.modified = False
+        try:
+            with open(os.path.join(self.directory, file_cache_index), 'r') as iFile:
+                self.index = json.load(iFile)
+        except (OSError, ValueError):
+            self.index = dict()
 
-            # If it made it this fare, this is usable data.
-            processed.append(line)
-        
-        # lines now stores the usable data
-        # processed will get filled with the lines of non-duplicate data (unique x values).
-        lines = processed.copy()
-        processed = []
-        toadd = [0,0]
-        summing = 1
-        
-        for i in range(len(lines)):
-            line = lines[i]
-            linels = lines[i].split(' ')
-            linels_next = lines[i+1].split(' ') if i!=len(lines)-1 else [0,0]
+    @staticmethod
+    def _hash(filepath):
+        digest = hashlib.sha1()
+        with open(filepath, 'rb') as iFile:
+            for block in iter(lambda: iFile.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def get(self, filepath, roi=None):
+        """Returns the cached (array, abundances) of a file or None if there isn't a valid entry.
+        roi is the region of interest the file is read with (see RegionOfInterest); it must match too."""
+        filepath = os.path.abspath(filepath)
+        entry = self.index.get(filepath)
+        stat = os.stat(filepath)
+        roi = list(roi) if roi else None
+        if entry is not None and entry['size'] == stat.st_size and entry.get('roi') == roi:
+            if entry['mtime'] != stat.st_mtime:
+                if entry['hash'] != self._hash(filepath):
+                    entry = None
+                else:
+                    entry['mtime'] = stat.st_mtime
+                    self.modified = True
+            if entry is not None:
+                try:
+                    arr = np.load(os.path.join(self.directory, entry['npy']), allow_pickle=False)
+                    self.hits += 1
+                    return arr, dict(entry['abund'])
+                except (OSError, ValueError):
+                    pass
+        self.misses += 1
+        return None
+
+    def put(self, filepath, arr, abund, roi=None):
+        """Stores the parsed array and abundances of a file, replacing its stale entry if there is one."""
+        if arr is None: return None
+        filepath = os.path.abspath(filepath)
+        stat = os.stat(filepath)
+        npy = os.path.basename(filepath).rsplit('.', 1)[0] + '_' + hashlib.sha1(filepath.encode()).hexdigest()[:8] + '.npy'
+        os.makedirs(self.directory, exist_ok=True)
+        np.save(os.path.join(self.directory, npy), arr, allow_pickle=False)
+        self.index[filepath] = dict(size=stat.st_size, mtime=stat.st_mtime, hash=self._hash(filepath), abund=abund, npy=npy,
+                                    roi=list(roi) if roi else None)
+        self.modified = True
+
+    def close(self):
+        """Evicts orphaned entries and files and saves the index."""
+        for filepath in [f for f in self.index if not os.path.isfile(f)]:
+            del self.index[filepath]
+            self.modified = True
+        if os.path.isdir(self.directory):
+            kept = {entry['npy'] for entry in self.index.values()}
+            for npy in os.listdir(self.directory):
+                if npy.endswith('.npy') and npy not in kept:
+                    os.remove(os.path.join(self.directory, npy))
+        if self.modified:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, file_cache_index), 'w') as oFile:
+                json.dump(self.index, oFile)
+            self.modified = False
+        if self.hits > 0: print(self.hits, 'spectra loaded from cache.')
+
+
+class SpectrumStore:
+    """Packed binary store of every Data spectrum, shared through np.memmap.
+    The file load/spectra.bin holds, for every substance, a (3, n) float64 block whose rows are ToF, y and energy.
+    Then spectrum_tof is block[0:2] and spectrum is block[2:0:-1]: both of them are views, no copy is made.
+    The index file (load/spectra_index.json) maps every substance key (kind_fullname) to its offset, n and
+    the flight path (cf.L0) its ToF row was computed with.
+    Every process opening the store maps the same file, so they all share the OS page cache.
+    input:
+        - directory: str
+            store directory. If unspecified (recomended), load."""
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.mm = None
+        self.index = dict()
+        self.stamp = None
+
+    def path(self, f):
+        return os.path.join(self.directory or paths.path('load'), f)
+
+    @staticmethod
+    def key(data):
+        return data.kind + '_' + data.fullname
+
+    def open(self):
+        """Maps the store (read only), unless it is already mapped and the file hasn't changed since."""
+        stamp = os.stat(self.path(file_store)).st_mtime_ns
+        if self.mm is None or stamp != self.stamp:
+            with open(self.path(file_store_index), 'r') as iFile:
+                self.index = json.load(iFile)
+            self.mm = np.memmap(self.path(file_store), dtype=np.float64, mode='r')
+            self.stamp = stamp
+        return self.mm
+
+    def write(self, Dict):
+        """Packs the spectra of a Data dictionary into a new store file, replacing the existing one."""
+        index, offset = dict(), 0
+        for name in Dict:
+            npoints = np.shape(Dict[name].spectrum)[1]
+            index[self.key(Dict[name])] = (offset, npoints, cf.L0(Dict[name].mode))
+            offset += 3*npoints
+        os.makedirs(self.path(''), exist_ok=True)
+        mm = np.memmap(self.path(file_store+'.tmp'), dtype=np.float64, mode='w+', shape=(max(offset, 1),))
+        for name in Dict:
+            start, npoints, _ = index[self.key(Dict[name])]
+            block = mm[start:start+3*npoints].reshape(3, npoints)
+            block[0:2] = Dict[name].spectrum_tof
+            block[2] = Dict[name].spectrum[0]
+        mm.flush()
+        del mm
+        os.replace(self.path(file_store+'.tmp'), self.path(file_store))
+        with open(self.path(file_store_index), 'w') as oFile:
+            json.dump(index, oFile)
+        self.mm = None
+
+    def views(self, data):
+        """Gives back the spectrum_tof and spectrum views of a substance, and the flight path of the former."""
+        mm = self.open()
+        if not self.key(data) in self.index:
+            raise KeyError('{} not found in the spectrum store. Pack the catalog again.'.format(self.key(data)))
+        start, npoints = self.index[self.key(data)][:2]
+        L0 = self.index[self.key(data)][2] if len(self.index[self.key(data)]) > 2 else None
+        block = mm[start:start+3*npoints].reshape(3, npoints)
+        return block[0:2], block[2:0:-1], L0
+
+
+store = SpectrumStore()
+
+
+class PeakCache:
+    """Memoization of the peaks of Data instances (see spectra_ObjectsFunc.propsisot).
+    Entries are keyed by a hash of everything the peaks are computed from: the spectrum (its content), the maxima,
+    the name and mode, the flight paths, the settings of the derivatives and the peak detection settings (peak_params).
+    Up to cf.peak_cache_mb megabytes of peak tables are kept in memory: past that, the least recently used ones are
+    evicted. With cf.peak_cache_disk, entries are also written to load/peakcache (a .npz per entry) and read from
+    there if they aren't in memory, so that they outlive the session. The files are kept within the same budget, the
+    least recently used going first as well (see prune). Errors of the computation aren't reported again when the
+    peaks come from the cache.
+    input:
+        - directory: str
+            disk cache directory. If unspecified (recomended), load/peakcache."""
+    # Settings (of cf.pack) that peak detection depends on.
+    peak_params = ('prangemax', 'slopedrop', 'dboxes', 'maxouterslope')
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits, self.misses = 0, 0
+        # Content hashes of the spectra, while they are alive: id -> (weak reference, hash).
+        self.digests = dict()
+
+    def path(self, f):
+        return os.path.join(self.directory or paths.join('load', dir_peakcache), f)
+
+    def _digest(self, arr):
+        """Content hash of an array, computed once per array."""
+        known = self.digests.get(id(arr))
+        if known is not None and known[0]() is arr: return known[1]
+        digest = hashlib.sha1(np.ascontiguousarray(arr)).hexdigest()
+        self.digests[id(arr)] = (weakref.ref(arr, lambda ref, i=id(arr): self.digests.pop(i, None)), digest)
+        return digest
+
+    def key(self, data, params):
+        digest = hashlib.sha1(self._digest(data.spectrum).encode())
+        for arr in (data.ma, data.mai):
+            arr = np.ascontiguousarray(arr)
+            digest.update(str((arr.dtype.str, arr.shape)).encode())
+            digest.update(arr)
+        digest.update(repr((data.fullname, data.mode, cf.L0_g, cf.L0_t, cf.default_mode, cf.maxleftslope, cf.itersmooth,
+                            [params[attr] for attr in self.peak_params])).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """A copy of the cached peak table, or None."""
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key].copy()
+        if cf.peak_cache_disk and os.path.isfile(self.path(key + '.npz')):
+            from .spectra_Objects import PeakTable
             try:
-                linels = [float(el) for el in linels]
-                linels_next = [float(el) for el in linels_next]
-            except:
-                print('Error produced when converting data to float.')
-            # Accumulates and averages the data we find...
-            toadd[0] = linels[0]
-            toadd[1] = (toadd[1]*(summing-1) + linels[1])/summing
-            summing += 1
-            # ...until the x value changes, or we get to the end of the file. Then reset.
-            if linels[0] != linels_next[0] or i == len(lines)-1:
-                processed.append(toadd)
-                summing = 1
-                toadd = [0,0]
-        
-        # Lists are created and returned, along with abundance
-        for i in range(len(processed)):
-            xlist.append(processed[i][0])
-            ylist.append(processed[i][1])
-        iFile.close()
-        return np.array([xlist,ylist]), abund
+                with np.load(self.path(key + '.npz'), allow_pickle=False) as data:
+                    table = PeakTable.fromcolumns({attr: data[attr] for attr in data.files})
+                # Used now: the last to be pruned.
+                os.utime(self.path(key + '.npz'))
+                self._keep(key, table)
+                self.hits += 1
+                return table.copy()
+            except (OSError, ValueError, KeyError):
+                pass
+        self.misses += 1
+        return None
+
+    def put(self, key, table):
+        """Keeps a copy of a peak table (and writes it to disk if cf.peak_cache_disk)."""
+        table = table.copy()
+        self._keep(key, table)
+        if cf.peak_cache_disk:
+            os.makedirs(self.path(''), exist_ok=True)
+            with open(self.path(key + '.npz.tmp'), 'wb') as oFile:
+                np.savez(oFile, **table.columns)
+            os.replace(self.path(key + '.npz.tmp'), self.path(key + '.npz'))
+            self.prune(key + '.npz')
+
+    def _keep(self, key, table):
+        if key in self.entries: self.nbytes -= self.entries.pop(key).nbytes()
+        self.entries[key] = table
+        self.nbytes += table.nbytes()
+        # Least recently used out (the newest entry is kept anyway).
+        while self.nbytes > cf.peak_cache_mb * 2**20 and len(self.entries) > 1:
+            self.nbytes -= self.entries.popitem(last=False)[1].nbytes()
+
+    def prune(self, newest):
+        """Removes the least recently used files of the disk cache (by modification time: reading a file touches it)
+        while they take more than cf.peak_cache_mb megabytes. The newest file is kept anyway.
+        Other processes may be writing and pruning the same directory: files that are gone are skipped."""
+        files = []
+        for entry in os.scandir(self.path('')):
+            if not entry.name.endswith('.npz'): continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.name))
+        nbytes = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if nbytes <= cf.peak_cache_mb * 2**20: break
+            if name == newest: continue
+            try:
+                os.remove(self.path(name))
+            except OSError:
+                pass
+            nbytes -= size
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def peaks(self, data, params):
+        """The peaks of a Data instance (as spectra_ObjectsFunc.propsisot), from the cache if they are there."""
+        from .spectra_ObjectsFunc import propsisot
+        if not (cf.peak_cache_mb or cf.peak_cache_disk): return propsisot(data, params)
+        key = self.key(data, params)
+        table = self.get(key)
+        if table is None:
+            table = propsisot(data, params)
+            self.put(key, table)
+        return table
+
+peakcache = PeakCache()
+
+
+def PackSpectra(Dict):
+    """Writes every spectrum in a Data dictionary to the spectrum store and makes the instances
+    point at it, dropping their own copies of spectrum and spectrum_tof."""
+    store.write(Dict)
+    for name in Dict:
+        Dict[name].attach()
+    print('{} spectra packed into "{}"'.format(len(Dict), store.path(file_store)))
 
 
 def ImportFileB(file):
     """Same function as ImportFile (see its docstrings), but imports three columns instead of two.
     The third column corresponds to the y error. Appliable to sample files.
-    Doesn't have filename-heading check.
+    Doesn't have filename-heading check. Only lines with exactly three columns are considered.
+    The x error of every point is the largest distance to its neighbours (to its only neighbour at the edges).
     Outputs an array with x, y, err_x, err_y"""
-    xlist,ylist,exlist,eylist = [],[],[],[]
-    global lines,processed
     with open(file,'r') as iFile:
-        lines = iFile.readlines()
-        processed = []
-        for line in lines:
-            if line[0] == "#": continue
-            while line.count('\n') + line.count('  ') != 0: line = line.replace('\n','').replace('  ',' ')
-            while line[0] == ' ': line = line[1:]
-            while line[-1] == ' ': line = line[:-1]
-            if line.count(' ') != 2: continue
-            processed.append(line)
-        lines = processed.copy()
-        processed = []
-        toadd = [0,0,0]
-        summing = 1
-        
-        for i in range(len(lines)):
-            line = lines[i]
-            linels = lines[i].split(' ')
-            linels_next = lines[i+1].split(' ') if i!=len(lines)-1 else [0,0,0]
-            try:
-                linels = [float(el) for el in linels]
-                linels_next = [float(el) for el in linels_next]
-            except:
-                print('Error produced when converting data to float')
-            toadd[0] = linels[0]
-            toadd[1] = (toadd[1]*(summing-1) + linels[1])/summing
-            toadd[2] = (toadd[2]*(summing-1) + linels[2])/summing
-            summing += 1
-            if linels[0] != linels_next[0] or i == len(lines)-1:
-                processed.append(toadd)
-                summing = 1
-                toadd = [0,0,0]
-        
-        for i in range(len(processed)):
-            xlist.append(processed[i][0])
-            ylist.append(processed[i][1])
-            if i==0:
-                exlist.append(processed[1][0]-processed[0][0])
-            elif i==len(processed)-1:
-                exlist.append(processed[-1][0]-processed[-2][0])
-            else:
-                exlist.append(max(processed[i+1][0]-processed[i][0], processed[i][0]-processed[i-1][0]))
-            eylist.append(processed[i][2])
-        iFile.close()
-        return np.array([xlist,ylist,exlist,eylist])
+        text = iFile.read()
+    x, y, ey = AverageDuplicates(ParseColumns(text, 3, exact=True))
+    steps = np.diff(x)
+    if np.size(steps) > 0:
+        ex = np.concatenate((steps[:1], np.maximum(steps[1:], steps[:-1]), steps[-1:]))
+    else:
+        ex = np.zeros(np.shape(x))
+    return np.array([x,y,ex,ey])
 
 
-def ImportData(directory=None):
+def ImportData(directory=None, processes=None, lazy=False):
     """Imports every file in the specified directory. Intended to be used for the Data files.
     It creates the actual Isotope, Element and Compound instances on the fly.
     How this works:
-        - First, it looks for the 'peakprops.txt file. If it exists, asks whether to import it.
+        - First, it looks for the 'peakprops.npz' or 'peakprops.txt' file. If it exists, asks whether to import it.
         - If importing: propsdict dictionary is loaded.
             Every time a file is imported, propsdict is consulted to get information on the peaks.
             If it is found, the appropriate class is called with this information to use it.
@@ -209,27 +671,38 @@ def ImportData(directory=None):
             Obviously there is not, so the appropriate classes are called with this None that
             tells them: get to work!
         - All the Isotope, Element and Compound instances are stored in dictionaries and then returned.
+        - Files are parsed and their instances built by ImportJob. If processes > 1, jobs are spread over a
+            pool of worker processes; the dictionaries and the errors report are the same as in serial.
     input:
         - directory: str
             directory path. If unspecified (recomended), imports 'data' file.
+        - processes: int
+            number of worker processes. 1: serial; 0: as many as CPU cores. If unspecified, cf.processes.
+        - lazy: bool
+            if True, nothing is parsed or computed here. Instead of the actual instances, the dictionaries
+            hold Proxy instances that run ImportJob (see LoadJob) the first time they are used.
     output:
         - isotdict: dictionary of Isotopes
         - elemdict: dictionary of Elements
         - compdict: dictionary of Compounds"""
-    from .spectra_Objects import Isotope, Element, Compound
-
     isotdict = dict()
     elemdict = dict()
     compdict = dict()
     
     path_peaks = paths.join('load', file_peaks_nonhuman)
+    path_peaks_bin = paths.join('load', file_peaks_bin)
     
-    if paths.isfx(file_peaks_nonhuman, 'load'):
-        inp = input('Import peak properties from file? ([y]/n) >')
+    if paths.isfx(file_peaks_nonhuman, 'load') or paths.isfx(file_peaks_bin, 'load'):
+        inp = basics.Ask('Import peak properties from file? ([y]/n) >')
         if inp in ans_quit:
             return dict(),dict(),dict()
         elif not inp in ans_no:
-            propsdict = LoadPeaks(path_peaks)
+            # The columnar file is preferred, unless the text file has been modified after it.
+            if paths.isfx(file_peaks_bin, 'load') and not (paths.isfx(file_peaks_nonhuman, 'load') and \
+                    os.path.getmtime(path_peaks) > os.path.getmtime(path_peaks_bin)):
+                propsdict = LoadPeaksBin(path_peaks_bin)
+            else:
+                propsdict = LoadPeaks(path_peaks)
         else:
             propsdict = dict()
     else:
@@ -243,8 +716,16 @@ def ImportData(directory=None):
     time.sleep(0.5)
     
     isotcount, elemcount, allycount, igncount= 0, 0, 0, 0
+    nlines, parsetime = 0, 0.
     if directory is None: directory = paths.data
-    for file in tqdm(os.listdir(directory), leave=False):
+    if processes is None: processes = cf.processes
+    if processes == 0: processes = os.cpu_count() or 1
+    cache = SpectrumCache() if cf.use_cache else None
+    roi = RegionOfInterest()
+
+    # Every job is a non-empty data file, in the same order os.listdir gives them.
+    jobs = []
+    for file in os.listdir(directory):
         filename = os.fsdecode(file)
         if not os.path.getsize(os.path.join(directory, filename)) > 0:
             # EMPTY FILE, ignore
@@ -253,32 +734,139 @@ def ImportData(directory=None):
         if filename.endswith(".asm") or filename.endswith(".py"):
             # Weird files? No thanks!
             continue
-        else:
-            name = filename.replace('element_','').replace('compound_','').split('.')[0]
-            arrout, abund = ImportFile(os.path.join(directory, filename), False)
-            if filename.startswith('element'):
+        filepath = os.path.join(directory, filename)
+        name = filename.replace('element_','').replace('compound_','').split('.')[0]
+        cached = cache.get(filepath, roi) if cache and not lazy else None
+        jobs.append((filepath, filename, propsdict.get(name), cached))
+
+    if lazy:
+        from .spectra_Objects import Proxy
+        for job in jobs:
+            name, kind = DataName(job[1])
+            proxy = Proxy(functools.partial(LoadJob, job), fullname=name, kind=kind, mode=basics.InterpretName(name)[3])
+            {'isotope': isotdict, 'element': elemdict, 'compound': compdict}[kind][name] = proxy
+        print(len(isotdict),'isotope files found.')
+        print(len(elemdict),'element files found.')
+        print(len(compdict),'compound files found.')
+        print('Lazy mode: files will be imported when needed.')
+        return isotdict, elemdict, compdict
+
+    # Parallel mode: results are given back in the same order as jobs, so that the outcome is the same as in serial.
+    # Only worker processes collect their errors and give them back: in this process, they are already in err.
+    parallel = processes > 1 and len(jobs) > 1 and 'fork' in mp.get_all_start_methods()
+    jobs = [job + (parallel,) for job in jobs]
+    if parallel:
+        executor = ProcessPoolExecutor(max_workers=processes, mp_context=mp.get_context('fork'))
+        results = executor.map(ImportJob, jobs)
+    else:
+        executor = None
+        results = map(ImportJob, jobs)
+
+    try:
+        for job, (name, obj, parsed, filelines, elapsed, errors) in tqdm(zip(jobs, results), total=len(jobs), leave=False):
+            for entry in errors:
+                err.add(entry['excep'], entry['func'], entry['subs'], entry['peakc'])
+            nlines += filelines
+            parsetime += elapsed
+            if cache and not parsed is None: cache.put(job[0], *parsed, roi)
+            if obj is None:
+                continue
+            elif obj.kind == 'element':
                 # ELEMENT DATAFILE
-                elemdict[name] = Element(name, arrout, abund, propsdict.get(name))
+                elemdict[name] = obj
                 elemcount+=1
-                continue
-            elif filename.startswith('compound'):
-                compdict[name] = Compound(name,arrout, abund, propsdict.get(name))
+            elif obj.kind == 'compound':
+                compdict[name] = obj
                 allycount+=1
             else:
                 # ISOTOPE DATAFILE
-                if not arrout is None:
-                    name = filename.split('.')[0]
-                    isotdict[name] = Isotope(name, arrout, propsdict.get(name))
-                    isotcount+=1
-                continue
+                isotdict[name] = obj
+                isotcount+=1
+    finally:
+        if executor: executor.shutdown()
+
     print(isotcount,'isotope files imported.')
     print(elemcount,'element files imported.')
     print(allycount,'compound files imported.')
     if igncount>0: print(igncount,'empty files ignored.')
+    if cache: cache.close()
+    if nlines>0: Throughput(nlines, parsetime)
 
     return isotdict, elemdict, compdict
 
-def ImportSamp(skipping=-1, skip_list=None):
+
+def ImportJob(job):
+    """Unit of work of ImportData: parses a single data file (unless its cached content is given) and builds
+    the actual Isotope, Element or Compound instance.
+    input:
+        - job: tuple
+            filepath, filename, peaks dictionary (or None), cached (array, abundances) (or None), and
+            whether the errors raised are to be given back (True when running in a worker process).
+    output:
+        - name: str
+        - obj: Isotope, Element, Compound or None
+        - parsed: (array, abundances) if the file was parsed, so that it can be cached. None otherwise.
+        - nlines: int, lines parsed
+        - elapsed: float, time (s) spent parsing
+        - errors: list of errors raised, as stored in err."""
+    from .spectra_Objects import Isotope, Element, Compound
+
+    filepath, filename, peaksdict, cached, collect = job
+    if collect: err.start()
+    name, kind = DataName(filename)
+
+    start = time.time()
+    roi = RegionOfInterest()
+    if cached is None:
+        arrout, abund, nlines = ParseFile(filepath, False) if roi is None else StreamFile(filepath, *roi)
+        parsed = (arrout, abund)
+    else:
+        arrout, abund = cached
+        nlines, parsed = 0, None
+    elapsed = time.time() - start if nlines > 0 else 0.
+
+    if kind == 'element':
+        obj = Element(name, arrout, abund, peaksdict)
+    elif kind == 'compound':
+        obj = Compound(name, arrout, abund, peaksdict)
+    elif not arrout is None:
+        obj = Isotope(name, arrout, peaksdict)
+    else:
+        obj = None
+
+    errors = list(err.get().values()) if collect else []
+    return name, obj, parsed, nlines, elapsed, errors
+
+
+def DataName(filename):
+    """Given a data filename, returns the substance name and its kind ('isotope', 'element' or 'compound')."""
+    if filename.startswith('element'):
+        kind = 'element'
+    elif filename.startswith('compound'):
+        kind = 'compound'
+    else:
+        kind = 'isotope'
+    return filename.replace('element_','').replace('compound_','').split('.')[0], kind
+
+
+def LoadJob(job):
+    """Loader of the Proxy instances given by ImportData in lazy mode.
+    Runs ImportJob for a single file, going through the spectrum cache if it is activated."""
+    cache = SpectrumCache() if cf.use_cache else None
+    cached = cache.get(job[0], RegionOfInterest()) if cache else None
+    _, obj, parsed, _, _, _ = ImportJob((job[0], job[1], job[2], cached, False))
+    if cache and not parsed is None:
+        cache.put(job[0], *parsed, RegionOfInterest())
+        cache.close()
+    return obj
+
+
+def LoadSample(filepath, name, mode, filename):
+    """Loader of the Proxy instances given by ImportSamp in lazy mode."""
+    from .spectra_Objects import Sample
+    return Sample(name, ParseFile(filepath, False)[0], mode, filename)
+
+def ImportSamp(skipping=-1, skip_list=None, lazy=False):
     """Imports every file in the specified directory. Intended to be used for the Sample files.
     It creates the actual Sample instances on the fly.
     It works in a very similar way than ImportData (see docstrings on that function). Differences are:
@@ -292,9 +880,11 @@ def ImportSamp(skipping=-1, skip_list=None):
                      0: not skipping
                      1: skipping files from skip_list
         - skip_list: list of files that will be ignored
+        - lazy: bool
+            if True, files aren't parsed here. Proxy instances are given instead (see LoadSample).
     output:
         - sampdict: dictionary of Samples"""
-    from .spectra_Objects import Sample
+    from .spectra_Objects import Sample, Proxy
 
     sampdict = dict()
     if not paths.isd('samples_n-tot'):
@@ -311,18 +901,19 @@ def ImportSamp(skipping=-1, skip_list=None):
         skipping = 0
     else:
         if skipping == -1:
-            skipping = int(input('Skip existing samples? ([y]/n) >') not in ans_no)
+            skipping = int(basics.Ask('Skip existing samples? ([y]/n) >') not in ans_no)
     
     assert skipping in [0, 1], 'Bad skipping value'
 
     naming = False
-    inp = input('Name manually? (y/[n]) >')
+    inp = basics.Ask('Name manually? (y/[n]) >')
     if inp in ans_yes:
         naming = True
     elif inp in ans_quit:
         return dict()
     
     tot_sampcount, tot_igncount, tot_oldcount = 0, 0, 0
+    nlines, parsetime = 0, 0.
 
     for mode in ['n-tot', 'n-g']:
         sampcount, igncount, oldcount = 0, 0, 0
@@ -347,9 +938,14 @@ def ImportSamp(skipping=-1, skip_list=None):
                 oldcount+=1
                 continue
             else:
-                arrout = ImportFile(os.path.join(directory,filename), False)[0]
+                filepath = os.path.join(directory,filename)
+                if not lazy:
+                    start = time.time()
+                    arrout, _, filelines = ParseFile(filepath, False)
+                    parsetime += time.time() - start
+                    nlines += filelines
                 # SAMPLE DATAFILE
-                if not arrout is None:
+                if lazy or not arrout is None:
                     if naming:
                         name = input('{}/{}: {} >'.format(sampcount+igncount+1, len(filelist), filename))
                         if name in ans_quit:
@@ -360,7 +956,11 @@ def ImportSamp(skipping=-1, skip_list=None):
                             continue
                     else:
                         name = filename.split('.')[0]
-                    sampdict[name] = Sample(name, arrout, mode, filename)
+                    if lazy:
+                        sampdict[name] = Proxy(functools.partial(LoadSample, filepath, name, mode, filename),
+                                               fullname=name, kind='sample', mode=mode, filename=filename)
+                    else:
+                        sampdict[name] = Sample(name, arrout, mode, filename)
                     sampcount+=1
                 continue
         
@@ -371,6 +971,7 @@ def ImportSamp(skipping=-1, skip_list=None):
     print(tot_sampcount,'sample files imported.')
     if tot_igncount>0: print(tot_igncount,'empty files ignored.')
     if tot_oldcount>0: print(tot_oldcount, 'old files ignored.')
+    if nlines>0: Throughput(nlines, parsetime)
     return dict(sampdict)
 
 
@@ -409,6 +1010,25 @@ def LoadPeaks(filepath):
     print('File of properties imported')
 
 
+def LoadPeaksBin(filepath):
+    """Reads the columnar peak properties file (see ExportPropsBin) to return the same dictionary as LoadPeaks,
+    with a PeakTable per substance.
+    output:
+        - THE dictionary of peaks."""
+    from .spectra_Objects import PeakTable
+
+    peaks = dict()
+    with np.load(filepath, allow_pickle=False) as data:
+        substances = data['substances'].tolist()
+        offsets = data['offsets']
+        columns = {attr: data[attr] for attr in data.files if not attr in ['substances', 'offsets']}
+    for isot, i0, i1 in zip(substances, offsets[:-1], offsets[1:]):
+        table = {attr: columns[attr][i0:i1] for attr in columns}
+        table[peakattr.get(0)] = np.full(i1-i0, isot)
+        peaks[isot] = PeakTable.fromcolumns(table)
+    return peaks
+
+
 def CreateEmptyFiles():
     """Creates all the empty files to be filled from Kaeri (for example) after the file 'Isotopes.txt'"""
     if paths.isfx('Isotopes.txt'):
@@ -501,7 +1121,7 @@ def MixInFile(filepath, Dict, permitted, kind=None):
         print('File does not exist')
         return dict()
     else:
-        if not input('Importing\n"'+filepath+'"\nContinue?\n'\
+        if not basics.Ask('Importing\n"'+filepath+'"\nContinue?\n'\
                      'Note: this is likely to take a while. ([y]/n) >') not in ans_no: return dict()
     
     mixels = []
@@ -662,4 +1282,38 @@ def ExportProps2(Dict):
 
             
             
-    
\ No newline at end of file
+    
+
+
+def ExportMatches(table, fmt='csv'):
+    """Exports the candidates of a batch peak matching (see spectra_ObjectsFunc.MatchAll) to the output
+    directory: matches.csv (a header and a line per candidate) or matches.npy (the structured array)."""
+    filepath = paths.join('output', file_matches + '.' + fmt)
+    if fmt == 'npy':
+        np.save(filepath, table, allow_pickle=False)
+    else:
+        import csv
+        with open(filepath, 'w', newline='') as oFile:
+            writer = csv.writer(oFile)
+            writer.writerow(table.dtype.names)
+            writer.writerows(table.tolist())
+    print('Exported: "{}"'.format(filepath))
+
+def ExportPropsBin(Dict):
+    """Given a Data dictionary, exports every peak property in columnar form (peakprops.npz).
+    There is an array per peak attribute (see PeakAttributes.column for its dtype and width), with a row
+    per peak, plus the substance names and an offset table: the peaks of substances[i] are the rows
+    offsets[i] to offsets[i+1]. Tuples shorter than the width and scalars are padded, and their lengths are stored
+    in length columns (see PeakTable).
+    The fullname attribute isn't stored, as it is given by the offset table."""
+    from .spectra_Objects import PeakTable
+
+    filepath = paths.join('load', file_peaks_bin)
+    substances = sorted(Dict)
+    offsets = np.cumsum([0] + [len(Dict[isot].peaks) for isot in substances])
+    # The peak tables of every substance, one after the other.
+    table = PeakTable.concat([PeakTable()] + [Dict[isot].peaks for isot in substances])
+    columns = {attr: table.columns[attr] for attr in table.columns if attr != peakattr.get(0)}
+    with open(filepath, 'wb') as oFile:
+        np.savez(oFile, substances=np.array(substances, dtype=str), offsets=offsets, **columns)
+    print('Exported: "{}"'.format(filepath))
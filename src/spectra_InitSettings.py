@@ -1,9 +1,34 @@
+def EntryPoint():
+    """True if the interpreter was started as python -m spectra (the command line entry point).
+    sys.orig_argv (python 3.10 onwards) is the whole command line and sys.argv its tail from the module on,
+    so the two items before that tail are '-m' and the name of the package. With older versions it can't be
+    told: the SPECTRA_BATCH environment variable has to be set instead."""
+    import sys
+    argv = getattr(sys, 'orig_argv', [])
+    package = __package__.rpartition('.')[0]
+    n = len(argv) - len(sys.argv)
+    return n >= 1 and argv[n-1:n+1] in (['-m', package], ['-m', package + '.__main__'])
+
+
 class Settings:
     def __init__(self):
         from ..settings import parameters
         for param in parameters:
             setattr(self,param,parameters[param])
-        
+        import os
+        # The command line entry point (see spectra_Batch) must be unattended from the very first import: the
+        # package (and spectra_Load with it) is imported before __main__.py runs.
+        if os.environ.get('SPECTRA_BATCH', '') not in ['', '0'] or EntryPoint(): self.batch = True
+        self._bounds()
+
+    def update(self, **kwargs):
+        """Overrides some parameters, recomputing the bounds that depend on them."""
+        for param in kwargs:
+            assert hasattr(self, param), 'Unknown setting: {}'.format(param)
+            setattr(self, param, kwargs[param])
+        self._bounds()
+
+    def _bounds(self):
         self.e_min   = self.t2E(self.thr_max,self.default_mode) if self.thr_in_tof else self.thr_min
         self.e_max   = self.t2E(self.thr_min,self.default_mode) if self.thr_in_tof else self.thr_max
         self.e_min_g = self.t2E(self.thr_max,'n-g')             if self.thr_in_tof else self.thr_min
@@ -24,10 +49,20 @@ class Settings:
     def L0(self,mode=None):
         if mode is None: mode = self.default_mode
         return self.L0_g if mode=='n-g' else (self.L0_t if mode=='n-tot' else None)
-    def E2t(self,En,mode=None):
-        return self.L0(mode)*1E6*(0.5*self.mn/(self.e*En))**0.5
-    def t2E(self,t,mode=None):
-        return 0.5*(self.mn/self.e)*((self.L0(mode)*1E6)/t)**2
+    def E2t(self,En,mode=None,out=None):
+        if out is None: return self.L0(mode)*1E6*(0.5*self.mn/(self.e*En))**0.5
+        # Same operations in the same order, but in the out buffer (no temporary arrays).
+        import numpy as np
+        np.multiply(self.e, En, out=out)
+        np.divide(0.5*self.mn, out, out=out)
+        np.sqrt(out, out=out)
+        return np.multiply(self.L0(mode)*1E6, out, out=out)
+    def t2E(self,t,mode=None,out=None):
+        if out is None: return 0.5*(self.mn/self.e)*((self.L0(mode)*1E6)/t)**2
+        import numpy as np
+        np.divide(self.L0(mode)*1E6, t, out=out)
+        np.square(out, out=out)
+        return np.multiply(0.5*(self.mn/self.e), out, out=out)
     def dt2dE(self,dt,t,mode=None):
         return 10**12*self.mn*self.L0(mode)**2/(self.e*t**3)*dt
     def dE2dt(self,dE,E,mode=None):
@@ -61,8 +96,12 @@ class Settings:
 
 
 class PeakAttributes:
-    totup = lambda ty: lambda inp: tuple([ty(el) for el in inp.split(',')])
+    # Tuples are written as their values separated by commas ('x,' for a 1-tuple, nothing for an empty one). A value
+    # without any comma is a scalar: e.g. the yvals of an unbounded peak, 0.
+    totup = lambda ty: lambda inp: tuple([ty(el) for el in inp.split(',') if el != '']) if ',' in inp or inp == '' else ty(inp)
     tobool= lambda inp: inp in ['True','true','1',1,'yes']
+    tofloats = totup(float)
+    toints = totup(int)
     attr = (
             (   'fullname'      ,   str             ),      #00   #Name of the isotope they belong to
             (   'num'           ,   int             ),      #01   #Peak label, mainly. Should match with integral_
@@ -83,13 +122,13 @@ class PeakAttributes:
             (   'ahh_'          ,   int             ),      #16   #AHH rank of peak
             (   'ahw'           ,   float           ),      #17   #AHW: Integral divided by height times width
             (   'ahw_'          ,   int             ),      #18   #AHW rank of peak
-            (   'xlims'         ,   totup(float)    ),      #19   #Energy values of peak bounds
-            (   'ilims'         ,   totup(int)      ),      #20   #Data indices of peak bounds
-            (   'outerslope'    ,   totup(float)    ),      #21   #Ideally, slope value far away from the peak and uncertainty (tuple). See documentation in definepeak for further information on this.
-            (   'peakreason'    ,   totup(int)      ),      #22   #Left and right boundaries reason (tuple). See documentation in definepeak for further information on this.
-            (   'yvals'         ,   totup(float)    ),      #23   #CS (or NC) values at peak boundaries (tuple)
-            (   'coords'        ,   totup(float)    ),      #24   #Energy and CS (or NC) values at peak summit
-            (   'coords_tof'    ,   totup(float)    ),      #25   #Time of Flight (us) and CS (or NC) values at peak summit
+            (   'xlims'         ,   tofloats        ),      #19   #Energy values of peak bounds
+            (   'ilims'         ,   toints          ),      #20   #Data indices of peak bounds
+            (   'outerslope'    ,   tofloats        ),      #21   #Ideally, slope value far away from the peak and uncertainty (tuple). See documentation in definepeak for further information on this.
+            (   'peakreason'    ,   toints          ),      #22   #Left and right boundaries reason (tuple). See documentation in definepeak for further information on this.
+            (   'yvals'         ,   tofloats        ),      #23   #CS (or NC) values at peak boundaries (tuple)
+            (   'coords'        ,   tofloats        ),      #24   #Energy and CS (or NC) values at peak summit
+            (   'coords_tof'    ,   tofloats        ),      #25   #Time of Flight (us) and CS (or NC) values at peak summit
             (   'prange'        ,   int             ),      #26   #prange value. See documentation in definepeak for further information on this.
             (   'user_edited'   ,   tobool          ),      #27   #True if user has edited the peak, False if the peak attributes are all from computation.
             (   'user_defined'  ,   tobool          ),      #28   #True if user has defined the peak, False if the peak is defined from computation.
@@ -118,6 +157,12 @@ class PeakAttributes:
     def getlist(self):
         return [self.get(i) for i in range(self.size)]
 
+    def column(self,ind):
+        """Numpy dtype and width (number of columns) the ind-th attribute is stored with in columnar form."""
+        cls = type(self)
+        return {int: ('i8',1), float: ('f8',1), str: ('U',1), cls.tobool: ('?',1),
+                cls.tofloats: ('f8',2), cls.toints: ('i8',2)}[self.gettup(ind)[1]]
+
 class ErrorReporter:
     def __init__(self):
         self.start()
@@ -26,31 +26,36 @@ import matplotlib.pyplot as plt
 from .spectra_Basics import isd, isf, isfx
 from .spectra_Objects import Catalog
 from .spectra_InitSettings import cf, err, paths
-from .spectra_FileHandlers import pload
+from .spectra_FileHandlers import pload, sload, ShardsExist
 
 #This allows plots to be detached from the command line.
 plt.ion()
 
 #Required directories:
+#In batch mode, spectra_Batch.Run checks them, once the directories given in the command line are set.
 
+if not cf.batch:
+    assert isd('data'), 'Missing directory: {}'.format(paths.data)
 
-assert isd('data'), 'Missing directory: {}'.format(paths.data)
+    if not isd('output'):
+        os.mkdir(paths.output)
 
-if not isd('output'):
-    os.mkdir(paths.output)
+    if not isd('input'):
+        os.mkdir(paths.input)
 
-if not isd('input'):
-    os.mkdir(paths.input)
+    if not isd('load'):
+        os.mkdir(paths.load)
 
-if not isd('load'):
-    os.mkdir(paths.load)
-
-#If 'spcat.pickle' pickle exists, ask.
+#If the catalog shards or the 'spcat.pickle' pickle exist, ask.
 #Either load it or create the insntace
-if paths.isfx('spcat.pickle', 'load'):
+#In batch mode, nothing is built here: that's left to spectra_Batch (or whoever imported the package).
+shards = cf.use_shards and ShardsExist()
+if cf.batch:
+    spcat = None
+elif shards or paths.isfx('spcat.pickle', 'load'):
     inp = input('Load catalog from file? ([y]/n) >')
     if not inp in ['n','no','q','quit']:
-        spcat = pload()
+        spcat = sload() if shards else pload()
     elif not inp in ['q','quit']:
         spcat = Catalog()
 else:
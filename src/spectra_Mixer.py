@@ -2,7 +2,6 @@ import os
 import sys
 from tqdm import tqdm
 from datetime import datetime
-import time
 import shutil
 
 import numpy as np
@@ -13,9 +12,20 @@ from . import spectra_Basics as basic
 from .spectra_InitSettings import cf, err
 
 def Interpolate(arrayin,value):
-    """Function that locates the value between to elements in an array and returns the linear interpolation."""
+    """Function that locates the value between to elements in an array and returns the linear interpolation.
+    value can also be an array of values, all of them interpolated at once (x values must be monotonic then)."""
     arrx = arrayin[0]
     arry = arrayin[1]
+    if np.ndim(value) > 0:
+        i0,i1 = basic.Brackets(arrx,value,True,-1).T
+        x0,x1 = arrx[i0],arrx[i1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            coef = (value-x0)/(x1-x0)
+            valy = arry[i1]*coef + arry[i0]*(1-coef)
+        exact = i0 == i1
+        valy[exact] = arry[i0[exact]]
+        valy[i0 < 0] = np.nan
+        return valy
     if value in arrx: return arry[basic.GetIndex(arrx,value)]
     x0,x1 = basic.InBetween(arrx,value,False)
     i0,i1 = basic.InBetween(arrx,value,True)
@@ -42,15 +52,12 @@ def GetWeighted(Dict,element,suf,composition):
     #We start it and compute the mathematical union of the individual meshes. But only the bits that fall within startmesh and endmesh
     mesh = np.empty((0))
     for c in composition:
-            mesh = np.union1d(mesh, Dict[c+suf].spectrum[0, basic.InBetween(Dict[c+suf].spectrum[0,:],startmesh,True)[1] : basic.InBetween(Dict[c+suf].spectrum[0,:],endmesh,True)[0] ])
+            (_, istart), (iend, _) = basic.Brackets(Dict[c+suf].spectrum[0,:],(startmesh,endmesh),True)
+            mesh = np.union1d(mesh, Dict[c+suf].spectrum[0, istart : iend ])
 
     #The y values are computed by interpolating each of the y values in the mesh and stored in the components dictionary.
     for component in composition:
-        time.sleep(.5)
-        valy = np.empty((0))
-        for xx in mesh:#tqdm(mesh,desc=component,leave=False):
-            valy = np.append(valy,Interpolate(Dict[component+suf].spectrum,xx))
-        components[component] = valy
+        components[component] = Interpolate(Dict[component+suf].spectrum,mesh)
     
     #We join together the mesh and the sum of the components weighted by their correspoinding value, and return it
     return np.array([mesh,np.sum([components[comp]*composition[comp] for comp in composition],axis=0)])
\ No newline at end of file
@@ -21,7 +21,9 @@ class Catalog:
 
     def __init__(self,**kwargs):
         self.volumes = basic.catalog_volumes
-        self.loadfiles()
+        # Lazy: substances are Proxy instances, imported and computed the first time they are used.
+        self.lazy = kwargs.get('lazy', cf.lazy)
+        self.loadfiles(samples=kwargs.get('samples', True), mixes=kwargs.get('mixes', True))
         self.date_created = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
 
     def _format(self, **kwargs):
@@ -36,12 +38,13 @@ class Catalog:
         for volume in self.volumes:
             setattr(self, volume, dict( getattr(self,volume), **kwargs.get(volume,dict()) ) )
 
-    def loadfiles(self):
+    def loadfiles(self, samples=True, mixes=True):
         self._format()
         err.start()
         self.data_in()
-        self.sample_in()
-        self.mix_in()
+        if samples: self.sample_in()
+        if mixes: self.mix_in()
+        if cf.use_store and not self.lazy: self.pack()
         err.present()
 
     def _discriminate(self,Dict,mode=None):
@@ -127,24 +130,32 @@ class Catalog:
     def get(self,inp,otherwise=None):
         return self.Substances().get(inp, otherwise)
 
+    def pack(self):
+        from .spectra_FileHandlers import PackSpectra
+        PackSpectra(self.Datas())
+
     def export(self):
-        from .spectra_FileHandlers import ExportProps, ExportProps2
+        from .spectra_FileHandlers import ExportProps, ExportProps2, ExportPropsBin
         ExportProps(self.Datas())
         ExportProps2(self.Datas())
+        ExportPropsBin(self.Datas())
 
     def save(self):
-        from .spectra_FileHandlers import psave
+        from .spectra_FileHandlers import psave, ssave
         self.date_modified = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-        psave(self)
+        if cf.use_shards:
+            ssave(self)
+        else:
+            psave(self)
 
     def data_in(self):
         from .spectra_FileHandlers import ImportData
-        new_isotopes, new_elements, new_compounds = ImportData()
+        new_isotopes, new_elements, new_compounds = ImportData(lazy=getattr(self, 'lazy', False))
         self.update(isotopes=new_isotopes, elements=new_elements, compounds=new_compounds)
 
     def sample_in(self):
         from .spectra_FileHandlers import ImportSamp
-        self.update(samples=ImportSamp(skipping=-1, skip_list=  self.sample_files()))
+        self.update(samples=ImportSamp(skipping=-1, skip_list=  self.sample_files(), lazy=getattr(self, 'lazy', False)))
 
     def mix_out(self):
         from .spectra_FileHandlers import MixOut
@@ -177,10 +188,246 @@ class Catalog:
             outp.append(samp.filename)
         return outp
 
+    def peakindex(self, mode=None):
+        """Index of the peaks of every Data of a mode (see PeakIndex). It is built the first time it is asked
+        for, and brought up to date with the catalog every other time."""
+        indices = self.__dict__.setdefault('_peakindex', dict())
+        if not mode in indices:
+            indices[mode] = PeakIndex(self.Datas(mode))
+        else:
+            indices[mode].refresh(self.Datas(mode))
+        return indices[mode]
+
+    def __getstate__(self):
+        # Peak indices aren't pickled: they are built again when needed.
+        state = dict(self.__dict__)
+        state.pop('_peakindex', None)
+        return state
+
     plot = plotter.Plot
     pmatch = func.MatchPeaks
+    pmatchall = func.MatchAll
     pcompare = func.ComparePeaks
 
+class IntegralIndex:
+    """Cumulative index of an x-y array that gives the integral of any window between two indices in constant
+    time, as func.Integrate does (Simpson's rule, as in scipy's simpson, minus a trapezoid background).
+    Simpson's rule is a sum of contributions of pairs of intervals, each starting every other point, plus a
+    correction of the last interval if there is an odd number of them. The contributions are summed cumulatively
+    for each parity of their starting point, and so are their rounding errors (two-sum), so that the difference of
+    two cumulative sums keeps about the precision of a direct sum, even for small windows of big spectra.
+    Precision: the Simpson integral of a window agrees with scipy's to about 1e-13 of its size. The integral minus
+    the background is only as precise as the bigger of the two: where they almost cancel out (a small peak over a
+    big background), its relative difference from func.Integrate is bigger (up to about 1e-12 on the peaks of the
+    isotope data, and more on arbitrary windows). See tests/test_objects.py.
+    input:
+        - array: np.ndarray
+            x-y array (horizontal) to be integrated. x doesn't have to be increasing."""
+    def __init__(self, array):
+        self.x = np.asarray(array[0], dtype=float)
+        self.y = np.asarray(array[1], dtype=float)
+        x, y = self.x, self.y
+        h = np.diff(x)
+        h0, h1 = h[:-1], h[1:]
+
+        # Contribution of the pair of intervals starting at every point (as scipy's _basic_simpson).
+        hsum = h0 + h1
+        hprod = h0 * h1
+        h0divh1 = np.true_divide(h0, h1, out=np.zeros_like(h0), where=h1 != 0)
+        pairs = hsum/6.0 * (y[:-2] * (2.0 - np.true_divide(1.0, h0divh1, out=np.zeros_like(h0divh1), where=h0divh1 != 0)) +
+                            y[1:-1] * (hsum * np.true_divide(hsum, hprod, out=np.zeros_like(hsum), where=hprod != 0)) +
+                            y[2:] * (2.0 - h0divh1))
+        self.hi, self.lo = [], []
+        for parity in [0, 1]:
+            terms = pairs[parity::2]
+            hi = np.cumsum(terms)
+            prev = np.hstack(([0.], hi[:-1]))
+            virtual = hi - prev
+            errors = (prev - (hi - virtual)) + (terms - virtual)
+            self.hi.append(np.hstack(([0.], hi)))
+            self.lo.append(np.hstack(([0.], np.cumsum(errors))))
+
+    def _pairs(self, start, npairs):
+        """Sum of npairs contributions from start on (every other point)."""
+        parity = start % 2
+        k0, k1 = start//2, start//2 + npairs
+        hi = np.where(parity == 0, self.hi[0][np.minimum(k1, len(self.hi[0])-1)] - self.hi[0][np.minimum(k0, len(self.hi[0])-1)],
+                                   self.hi[1][np.minimum(k1, len(self.hi[1])-1)] - self.hi[1][np.minimum(k0, len(self.hi[1])-1)])
+        lo = np.where(parity == 0, self.lo[0][np.minimum(k1, len(self.lo[0])-1)] - self.lo[0][np.minimum(k0, len(self.lo[0])-1)],
+                                   self.lo[1][np.minimum(k1, len(self.lo[1])-1)] - self.lo[1][np.minimum(k0, len(self.lo[1])-1)])
+        return hi + lo
+
+    def _correction(self, last):
+        """Correction of the last interval of windows ending at last (Cartwright), from its last two spacings."""
+        x, y = self.x, self.y
+        hm2, hm1 = x[last-1] - x[last-2], x[last] - x[last-1]
+        with np.errstate(invalid='ignore', over='ignore'):
+            alpha = np.true_divide(2 * hm1 ** 2 + 3 * hm2 * hm1, 6 * (hm1 + hm2), out=np.zeros(np.shape(last)), where=6 * (hm1 + hm2) != 0)
+            beta = np.true_divide(hm1 ** 2 + 3.0 * hm2 * hm1, 6 * hm2, out=np.zeros(np.shape(last)), where=6 * hm2 != 0)
+            eta = np.true_divide(1 * hm1 ** 3, 6 * hm2 * (hm2 + hm1), out=np.zeros(np.shape(last)), where=6 * hm2 * (hm2 + hm1) != 0)
+        return alpha*y[last] + beta*y[last-1] - eta*y[last-2]
+
+    def simpson(self, i0, i1):
+        """Simpson's rule between indices i0 and i1 (both included). They can be arrays of windows."""
+        i0, i1 = np.asarray(i0, dtype=np.int64), np.asarray(i1, dtype=np.int64)
+        x, y = self.x, self.y
+        npoints = i1 - i0 + 1
+        odd = npoints % 2 == 1
+        result = self._pairs(i0, np.where(odd, (npoints-1)//2, (npoints-2)//2))
+        # Even number of points: correction of the last interval (or a trapezoid, if there's only one)
+        last = np.clip(i1, 2, np.size(x)-1)
+        corrected = result + self._correction(last)
+        trapezoid = 0.5*(x[i1]-x[i1-1])*(y[i1]+y[i1-1])
+        result = np.where(odd, result, np.where(npoints == 2, trapezoid, corrected))
+        return np.where(npoints >= 1, result, np.nan)
+
+    def integrate(self, i0, i1):
+        """Integral between indices i0 and i1, minus the trapezoid background (see func.Integrate)."""
+        i0, i1 = np.asarray(i0, dtype=np.int64), np.asarray(i1, dtype=np.int64)
+        background = 0.5*(self.x[i1]-self.x[i0])*(self.y[i1]+self.y[i0])
+        return self.simpson(i0, i1) - background
+
+class PeakIndex:
+    """Index of the peak centers (ToF) of many substances: sorted, each one pointing back to its substance and
+    label, for nearest and window queries in logarithmic time (per substance, for closest).
+    It is kept up to date with refresh: the peaks of the substances whose peak table has been replaced since
+    they were indexed (Data.edit, Data.delete, recompute) are taken out and merged in again.
+    input:
+        - Dict: dictionary of Data instances to index."""
+    def __init__(self, Dict=dict()):
+        self.tof = np.empty(0)
+        self.owner = np.empty(0, dtype=np.int64)
+        self.label = np.empty(0, dtype=np.int64)
+        # Owner codes: names[owner] is the name of the substance of a peak.
+        self.names, self.codes = [], dict()
+        # Indexed substances: name -> (substance, peak table it was indexed with).
+        self.substances = dict()
+        self.refresh(Dict)
+
+    def refresh(self, Dict):
+        """Takes out the substances that aren't in Dict anymore or whose peaks have changed, and puts in the
+        new ones and the changed ones again."""
+        changed = [name for name in self.substances if not name in Dict or Dict[name] is not self.substances[name][0]
+                   or Dict[name].peaks is not self.substances[name][1]]
+        if changed or any(not name in self.substances for name in Dict): self._groups = None
+        if changed:
+            keep = ~np.isin(self.owner, [self.codes[name] for name in changed])
+            self.tof, self.owner, self.label = self.tof[keep], self.owner[keep], self.label[keep]
+            for name in changed: del self.substances[name]
+        new = [name for name in Dict if not name in self.substances]
+        if not new: return
+        tof, owner, label = [], [], []
+        for name in new:
+            if not name in self.codes:
+                self.codes[name] = len(self.names)
+                self.names.append(name)
+            peaks = Dict[name].peaks
+            self.substances[name] = (Dict[name], peaks)
+        # In the order of Dict (substances as close as each other are given in this order).
+        self.substances = {name: self.substances[name] for name in Dict}
+        for name in new:
+            peaks = self.substances[name][1]
+            tof.append(peaks.column('center_tof'))
+            owner.append(np.full(len(peaks), self.codes[name]))
+            label.append(np.arange(len(peaks)))
+        tof, owner, label = np.concatenate(tof).astype(float), np.concatenate(owner), np.concatenate(label)
+        # Merging: only the new peaks are sorted.
+        order = np.argsort(tof, kind='stable')
+        positions = np.searchsorted(self.tof, tof[order], side='right')
+        self.tof = np.insert(self.tof, positions, tof[order])
+        self.owner = np.insert(self.owner, positions, owner[order])
+        self.label = np.insert(self.label, positions, label[order])
+
+    def __len__(self):
+        return np.size(self.tof)
+
+    def _rows(self, i0, i1):
+        return np.array(self.names, dtype=object)[self.owner[i0:i1]], self.label[i0:i1]
+
+    def window(self, lo, hi):
+        """Peaks with their center between lo and hi (both included), sorted.
+        outputs:
+            - arrays of substance names, labels and centers."""
+        i0, i1 = np.searchsorted(self.tof, lo, side='left'), np.searchsorted(self.tof, hi, side='right')
+        return self._rows(i0, i1) + (self.tof[i0:i1],)
+
+    def nearest(self, xx, k=1):
+        """The k peaks closest to xx, closest first.
+        outputs:
+            - arrays of substance names, labels and distances."""
+        ic = np.searchsorted(self.tof, xx)
+        i0, i1 = max(ic - k, 0), min(ic + k, len(self))
+        dist = np.abs(self.tof[i0:i1] - xx)
+        order = np.argsort(dist, kind='stable')[:k]
+        names, labels = self._rows(i0, i1)
+        return names[order], labels[order], dist[order]
+
+    def matches(self, xx, distmax, Dict=None):
+        """For each of many positions xx, the closest peak of every substance (of Dict, if given) that is closer
+        than distmax, ranked by distance (as closest does for one position), all at once.
+        outputs:
+            - arrays with a row per match: index in xx, substance name, label, center, distance and rank
+            (0: the closest to that position). Sorted by position and rank."""
+        xx = np.asarray(xx, dtype=float)
+        names = [name for name in (self.substances if Dict is None else Dict) if name in self.substances]
+        # Substances as close as each other are ranked in the order of names (or left out).
+        position = np.full(len(self.names), -1, dtype=np.int64)
+        position[[self.codes[name] for name in names]] = np.arange(len(names))
+
+        # Every peak within distmax of every position (with a peak more at each side: xx -/+ distmax are rounded).
+        i0 = np.maximum(np.searchsorted(self.tof, xx - distmax, side='left') - 1, 0)
+        i1 = np.minimum(np.searchsorted(self.tof, xx + distmax, side='right') + 1, len(self))
+        ind, _ = func.Segments(i0, np.maximum(i1 - i0, 0))
+        which = np.repeat(np.arange(np.size(xx)), np.maximum(i1 - i0, 0))
+        dist = np.abs(self.tof[ind] - xx[which])
+        keep = (dist < distmax) & (position[self.owner[ind]] >= 0)
+        ind, which, dist = ind[keep], which[keep], dist[keep]
+        owner, label = self.owner[ind], self.label[ind]
+
+        # Closest peak of each substance to each position (the first one, if several are as close)
+        order = np.lexsort((label, dist, owner, which))
+        first = np.r_[True, (owner[order][1:] != owner[order][:-1]) | (which[order][1:] != which[order][:-1])] if np.size(order) else []
+        ind, which, dist, owner, label = ind[order][first], which[order][first], dist[order][first], owner[order][first], label[order][first]
+        order = np.lexsort((position[owner], dist, which))
+        ind, which, dist, owner, label = ind[order], which[order], dist[order], owner[order], label[order]
+        starts = np.searchsorted(which, which, side='left')
+        rank = np.arange(np.size(which)) - starts
+        return which, np.array(self.names, dtype=object)[owner], label, self.tof[ind], dist, rank
+
+    def _grouped(self):
+        """Positions of the peaks grouped by substance (sorted within each one), and their search keys."""
+        if getattr(self, '_groups', None) is None:
+            bygroup = np.argsort(self.owner, kind='stable')
+            self._groups = bygroup, self.owner[bygroup]*len(self) + bygroup
+        return self._groups
+
+    def closest(self, xx, Dict=None, distmax=None):
+        """For every substance (of Dict, if given), its peak closest to xx (if closer than distmax, if given).
+        outputs:
+            - array with a row per substance (substance, distance, label), closest first, as RankNearest."""
+        names = [name for name in (self.substances if Dict is None else Dict)
+                 if name in self.substances and len(self.substances[name][1]) > 0]
+        codes = np.array([self.codes[name] for name in names], dtype=np.int64)
+        ic = np.searchsorted(self.tof, xx)
+        # Within each substance, the peaks right before and right after xx.
+        bygroup, keys = self._grouped()
+        after = np.searchsorted(keys, codes*len(self) + ic)
+        before = after - 1
+        after = np.minimum(after, len(self)-1)
+        candidates = np.vstack((bygroup[np.maximum(before, 0)], bygroup[after]))
+        valid = np.vstack((before >= 0, np.ones(np.size(codes), dtype=bool))) & (self.owner[candidates] == codes)
+        dist = np.where(valid, np.abs(self.tof[candidates] - xx), np.inf)
+        label = self.label[candidates]
+        # The closest one (the first one, if both are as close)
+        right = (dist[1] < dist[0]) | ((dist[1] == dist[0]) & (label[1] < label[0]))
+        dist, label = np.where(right, dist[1], dist[0]), np.where(right, label[1], label[0])
+        found = dist < distmax if distmax is not None else np.isfinite(dist)
+        rows = sorted(np.flatnonzero(found), key=lambda i: dist[i])
+        outp = np.empty((len(rows), 3), dtype=object)
+        for n, i in enumerate(rows):
+            outp[n] = (self.substances[names[i]][0], dist[i], label[i])
+        return outp
+
 class Summer:
     def __init__(self):
         self.values = dict()
@@ -221,15 +468,71 @@ class Summer:
             outp[key] = res
         return outp
 
+class Proxy:
+    """Lightweight stand-in for a Substance in a Catalog volume.
+    It knows a few cheap attributes (fullname, kind, mode...) and a loader. On first access to any other
+    attribute the loader builds or reads the actual instance, and from then on everything is forwarded to it.
+    inputs:
+        - loader: callable without arguments that returns the Substance instance.
+        - origin: path of the record the instance is read from, if any (see spectra_FileHandlers.sload).
+        - known: attributes that are answered without loading."""
+    def __init__(self, loader, origin=None, **known):
+        object.__setattr__(self, '_loader', loader)
+        object.__setattr__(self, '_target', None)
+        object.__setattr__(self, 'origin', origin)
+        object.__setattr__(self, '_known', tuple(known))
+        for attr in known:
+            object.__setattr__(self, attr, known[attr])
+
+    def load(self):
+        if self._target is None:
+            object.__setattr__(self, '_target', self._loader())
+            for attr in self._known:
+                object.__delattr__(self, attr)
+        return self._target
+
+    def target(self):
+        """The actual instance if it has been loaded, None otherwise."""
+        return self._target
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'): raise AttributeError(attr)
+        return getattr(self.load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.load(), attr, value)
+
+    def __repr__(self):
+        return '<Proxy of {} ({})>'.format(self.fullname, 'loaded' if self._target is not None else 'not loaded')
+
 class Substance:
+    # Attributes that are only caches, computed again when needed: setting them doesn't make an instance dirty.
+    _caches = ('dirty', '_axes', '_derkey', '_integrals', '_peakskey')
+
+    def __setattr__(self, attr, value):
+        super().__setattr__(attr, value)
+        if attr not in self._caches: self.__dict__['_dirty'] = True
+
+    @property
+    def dirty(self):
+        """True if the instance has changed since it was last saved (see spectra_FileHandlers.ssave): any of its
+        attributes has been set, or any of its peaks (see PeakTable.set)."""
+        return self.__dict__.get('_dirty', True) or getattr(self.__dict__.get('_peaks'), 'dirty', False)
+
+    @dirty.setter
+    def dirty(self, value):
+        self.__dict__['_dirty'] = value
+        if not value and self.__dict__.get('_peaks') is not None: self.__dict__['_peaks'].dirty = False
+
     def __init__(self,namestr,array):
         self.fullname = namestr
+        self.dirty = True
         self.npeaks = np.shape(self.ma)[1]
-        self.der = np.array([(array[1,i+1]-array[1,i])/(array[0,i+1]-array[0,i]) for i in range(np.shape(array)[1]-1)])
-        i0 = basic.GetIndex(np.int32(self.der<0),0)
-        target = np.hstack((np.ones((i0)),np.zeros((np.size(self.der)-i0))))
-        self.der = self.der*(np.int64(np.abs(self.der)<cf.maxleftslope)*target + (1-target))
-        self.sder = basic.Smooth(self.der,cf.itersmooth)
+        # The derivatives are kept if neither the spectrum nor the settings they depend on have changed (recompute).
+        derkey = (cf.maxleftslope, cf.itersmooth)
+        if getattr(self, '_derkey', None) is None or self._derkey[0] is not array or self._derkey[1:] != derkey:
+            self.der, self.sder = func.derivatives(array, *derkey)
+            self._derkey = (array,) + derkey
         self.date_created = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
         
     def plot(self,showlim=True,showma=True,tof=None,peaklabs=True):
@@ -253,6 +556,76 @@ class Substance:
     def arr_dt2dE(self):
         pass
 
+    # Spectra derived from another one by converting its x values: name -> (source, conversion).
+    conversions = dict()
+
+    def _converted(self, name):
+        """Gives back a derived spectrum (see conversions). It is computed the first time it is asked for and
+        kept while the source spectrum and the flight path of the mode (cf.L0) don't change."""
+        source, conv = self.conversions[name]
+        arr = getattr(self, source)
+        key = (self.mode, cf.L0(self.mode))
+        axes = self.__dict__.setdefault('_axes', dict())
+        if name in axes and axes[name][0] == key and axes[name][1] is arr:
+            return axes[name][2]
+        out = np.empty(np.shape(arr))
+        getattr(cf, conv)(arr[0], self.mode, out=out[0])
+        out[1:] = arr[1:]
+        axes[name] = (key, arr, out)
+        return out
+
+    def _setconverted(self, name, out):
+        """Sets a derived spectrum that has been computed somewhere else, with the current flight path."""
+        axes = self.__dict__.setdefault('_axes', dict())
+        axes[name] = ((self.mode, cf.L0(self.mode)), getattr(self, self.conversions[name][0]), out)
+
+    def integrals(self, name='spectrum', keep=True):
+        """Gives back the integral index (see IntegralIndex) of one of the spectra of the substance (spectrum,
+        spectrum_tof, stripped...). It is built the first time it is asked for and kept (if keep) while that
+        spectrum isn't replaced."""
+        arr = getattr(self, name)
+        indices = self.__dict__.setdefault('_integrals', dict())
+        if name in indices and indices[name][0] is arr:
+            return indices[name][1]
+        index = IntegralIndex(arr)
+        if keep: indices[name] = (arr, index)
+        return index
+
+    def integrate(self, ilims, name='spectrum'):
+        """Integral of a spectrum between two indices minus the trapezoid background, as func.Integrate does.
+        If the integral index of the spectrum has been kept (see integrals), in constant time. Otherwise, a
+        single window is integrated directly (in the time of the window) and many windows at once through an
+        index that isn't kept: the catalog would keep one for every spectrum.
+        inputs:
+            - ilims: (ind, ind), or a (2,n) array with the edges of n windows.
+            - name: str
+                spectrum to be integrated (see integrals).
+        outputs:
+            - float, or array of n floats."""
+        arr = getattr(self, name)
+        indices = self.__dict__.get('_integrals', dict())
+        if name in indices and indices[name][0] is arr:
+            out = indices[name][1].integrate(ilims[0], ilims[1])
+        elif np.ndim(ilims[0]) == 0:
+            return func.Integrate(arr, ilims)
+        else:
+            out = self.integrals(name, keep=False).integrate(ilims[0], ilims[1])
+        return out if np.ndim(out) else out[()]
+
+    def __getstate__(self):
+        # Derived spectra and integral indices aren't pickled: they are computed again when needed.
+        state = dict(self.__dict__)
+        state.pop('_axes', None)
+        state.pop('_derkey', None)
+        state.pop('_integrals', None)
+        return state
+
+    def __setstate__(self, state):
+        # Catalogs pickled before derived spectra were computed on demand do have them.
+        for name in self.conversions: state.pop(name, None)
+        if 'dirty' in state: state['_dirty'] = state.pop('dirty')
+        self.__dict__.update(state)
+
     pick = func.pick
 
 class Data(Substance):
@@ -274,18 +647,80 @@ class Data(Substance):
             self.xbounds = cf.xbounds()
         
         self.ybounds = specific_settings.get('crs_min') or cf.ybounds(self.symb, self.mode)
+        # A spectrum from the store is kept as it is when recomputing (see attach).
+        if not (self.stored and array is self.spectrum): self.stored = False
         self.spectrum = array
-        self.spectrum_tof = self.arr_E2t(self.spectrum)
         self.xmagnitude = 'Energy (eV)'
         self.ymagnitude = 'Cross Section (b)'
         self.ma, self.mai = func.maxima(array, self.xbounds, self.ybounds, 0)
-        self.ma_tof = self.arr_E2t(self.ma)
         super().__init__(namestr,array)
-        self.peaks = peaksdict or func.propsisot(self, cf.pack(**specific_settings))
+        from .spectra_FileHandlers import peakcache
+        self.peaks = PeakTable.of(peaksdict) if peaksdict else peakcache.peaks(self, cf.pack(**specific_settings))
         self._seterrors()
         
     def _seterrors(self):
-        self.errors = [self.peaks[i] for i in self.peaks if self.peaks[i].xlims == (0.,0.)]
+        self.errors = [self.peaks[i] for i in np.flatnonzero(np.all(self.peaks.column('xlims') == 0., axis=1))]
+
+    conversions = {'spectrum_tof': ('spectrum', 'E2t'), 'ma_tof': ('ma', 'E2t')}
+
+    @property
+    def spectrum_tof(self):
+        return self._converted('spectrum_tof')
+
+    @property
+    def ma_tof(self):
+        return self._converted('ma_tof')
+
+    def _tofkey(self):
+        # Flight paths the ToF peak attributes depend on (coords_tof is converted with the default mode).
+        return (self.mode, cf.L0(self.mode), cf.default_mode, cf.L0())
+
+    @property
+    def peaks(self):
+        """PeakTable of the peaks. If the flight paths have changed since it was set, its ToF attributes are
+        computed again (see func.peakstof), in a new table."""
+        if self.__dict__.get('_peakskey') != self._tofkey():
+            table = func.peakstof(self, self._peaks)
+            table.dirty = self._peaks.dirty
+            self.__dict__['_peaks'] = table
+            self.__dict__['_peakskey'] = self._tofkey()
+        return self._peaks
+
+    @peaks.setter
+    def peaks(self, peaks):
+        self._peaks = peaks
+        self._peakskey = self._tofkey()
+
+    # True if spectrum and spectrum_tof are views of the spectrum store (see spectra_FileHandlers.SpectrumStore).
+    stored = False
+
+    def attach(self):
+        """Replaces spectrum and spectrum_tof with views of the spectrum store.
+        The ToF view is only taken if the store was packed with the current flight path.
+        The views hold the same values, so the instance isn't made dirty."""
+        from .spectra_FileHandlers import store
+        dirty = self.dirty
+        spectrum_tof, self.spectrum, L0 = store.views(self)
+        if L0 == cf.L0(self.mode): self._setconverted('spectrum_tof', spectrum_tof)
+        self.stored = True
+        self.dirty = dirty
+
+    def __getstate__(self):
+        # Stored spectra aren't pickled: they are mapped from the store again on load.
+        state = super().__getstate__()
+        if self.stored:
+            del state['spectrum']
+        return state
+
+    def __setstate__(self, state):
+        # Catalogs pickled before peaks were columnar have dictionaries of Peak instances, and their ToF
+        # attributes are taken as they are, as they always were.
+        peaks = state.pop('peaks', None)
+        super().__setstate__(state)
+        if peaks is not None:
+            self.peaks = PeakTable.of(peaks)
+            if isinstance(peaks, dict): self._seterrors()
+        if self.stored: self.attach()
 
     def infopeaks(self):
         from .spectra_FileHandlers import infoone
@@ -303,7 +738,8 @@ class Data(Substance):
         plt.show()
 
     def get_from_peaks(self,attr):
-        if peakattr.has(attr): return np.array([getattr(self.peaks[i],attr) for i in sorted(self.peaks)])
+        # A copy of the column (see PeakTable.column), in label order.
+        if peakattr.has(attr): return self.peaks.column(attr).copy()
 
     def getclosest(self,inp,in_tof=True):
         malist = self.get_from_peaks('ma_tof') if not in_tof else self.get_from_peaks('ma')
@@ -311,14 +747,14 @@ class Data(Substance):
     def edit(self):
         editing = func.EditPeaks(self)
         if editing != dict():
-            self.peaks = func.propsisot(self, cf.pack(), setx=editing)
+            self.peaks = func.propsedited(self, cf.pack(), editing)
             self._seterrors()
             self.date_edited = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
 
     def delete(self):
         deleting = func.DeletePeaks(self)
         if deleting != []:
-            self.peaks = func.sorting({i: self.peaks[i] for i in self.peaks if not i in deleting})
+            self.peaks = func.rerank(self.peaks, removed=deleting)
             self.npeaks = len(self.peaks)   
             self._seterrors()
             self.date_edited = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
@@ -361,23 +797,31 @@ class Isotope(Data):
 
 class Sample(Substance):
     kind = 'sample'
+    conversions = {'spectrum': ('spectrum_tof', 't2E'), 'ma': ('ma_tof', 't2E')}
+
+    @property
+    def spectrum(self):
+        return self._converted('spectrum')
+
+    @property
+    def ma(self):
+        return self._converted('ma')
+
     def __init__(self,namestr,arrayin,mode=None,filename=""):
         self.filename = filename
         self.intof = True
         self.xbounds = None
         self.ybounds = None
         if mode is None:
-            inp = input('Mode for {}: (1: n-g; 2: n-tot) >'.format(namestr))
+            inp = basic.Ask('Mode for {}: (1: n-g; 2: n-tot) >'.format(namestr))
             self.mode = {'1':'n-g', '2':'n-tot'}.get(inp,cf.default_smode)
             del inp
         else:
             self.mode = mode
         self.spectrum_tof = arrayin
-        self.spectrum = self.arr_t2E(self.spectrum_tof)
         self.xmagnitude = 'ToF (us)'
         self.ymagnitude = 'Counts'
         self.ma_tof, self.mai_tof = func.maxima(arrayin, None, None, cf.itersmoothsamp)
-        self.ma = self.arr_t2E(self.ma_tof)
         super().__init__(namestr,arrayin)
         func.sampprocess(self)
 
@@ -388,4 +832,157 @@ class Peak:
         for i in range(peakattr.size):
             setattr(self,peakattr.get(i),info[i])
 
+    pick = func.pick
+
+class PeakTable:
+    """Peaks of a spectrum in columnar form: an array per peak attribute (see PeakAttributes.column for its
+    dtype and width) with a row per peak. Tuples shorter than the width of their column are padded (nan, or 0 for
+    integers), and so are scalars (e.g. the yvals of an unbounded peak is 0, not a tuple). What each row holds is
+    kept in a length column per tuple attribute (see lengthkey): the length of the tuple, or -1 for a scalar.
+    A table is dirty once a value has been set (see set), which makes the substance that holds it dirty as well.
+    Rows are labelled by integral rank, like the keys of a dictionary of peaks: table[i] is a view of the i-th
+    row (see PeakView) and iterating over the table gives the labels.
+    input:
+        - peaks: iterable of peaks (Peak instances or views of another table)."""
+    dirty = False
+
+    def __init__(self, peaks=()):
+        peaks = list(peaks)
+        self.columns = dict()
+        for i in range(peakattr.size):
+            attr = peakattr.get(i)
+            dtype, width = peakattr.column(i)
+            values = [getattr(peak, attr) for peak in peaks]
+            if width > 1:
+                rows = [self._row(attr, dtype, width, val) for val in values]
+                self.columns[attr] = np.array([row for row, _ in rows], dtype=dtype).reshape(-1, width)
+                self.columns[self.lengthkey(attr)] = np.array([length for _, length in rows], dtype=np.int8)
+            else:
+                self.columns[attr] = np.array(values, dtype=dtype)
+
+    @staticmethod
+    def lengthkey(attr):
+        """Name of the length column of a tuple attribute."""
+        return attr + '.len'
+
+    @staticmethod
+    def _row(attr, dtype, width, value):
+        """Padded row of a tuple attribute for a value, and its length (-1 for a scalar)."""
+        pad = np.nan if np.dtype(dtype).kind == 'f' else 0
+        if not isinstance(value, (tuple, list)): return (value,) + (pad,)*(width-1), -1
+        if len(value) > width:
+            raise ValueError('{} holds up to {} values, {} given: {}'.format(attr, width, len(value), value))
+        return tuple(value) + (pad,)*(width-len(value)), len(value)
+
+    @classmethod
+    def fromcolumns(cls, columns):
+        """Table with the given dictionary of columns (an array per peak attribute, and the length columns).
+        Missing length columns (files written before they existed) are made up from the padding: every value
+        that isn't nan, and a single one is a scalar."""
+        table = cls.__new__(cls)
+        table.columns = dict()
+        for i in range(peakattr.size):
+            attr = peakattr.get(i)
+            column = table.columns[attr] = columns[attr]
+            if np.ndim(column) < 2: continue
+            key = cls.lengthkey(attr)
+            if key in columns:
+                table.columns[key] = columns[key]
+            elif column.dtype.kind == 'f':
+                lengths = np.sum(~np.isnan(column), axis=1)
+                table.columns[key] = np.where(lengths == 1, -1, lengths).astype(np.int8)
+            else:
+                table.columns[key] = np.full(np.shape(column)[0], np.shape(column)[1], dtype=np.int8)
+        return table
+
+    @classmethod
+    def of(cls, peaks):
+        """Table of a dictionary of peaks (rows in the order of their labels), or the table itself."""
+        if isinstance(peaks, cls): return peaks
+        return cls(peaks[i] for i in sorted(peaks))
+
+    @classmethod
+    def concat(cls, tables):
+        """Table with the rows of some tables, one after the other."""
+        return cls.fromcolumns({attr: np.concatenate([table.columns[attr] for table in tables]) for attr in tables[0].columns})
+
+    def take(self, rows):
+        """Table with some rows (indices or boolean mask) of this one."""
+        return self.fromcolumns({attr: self.columns[attr][rows] for attr in self.columns})
+
+    def column(self, attr):
+        """Array of an attribute, a value per row. It isn't a copy."""
+        return self.columns[attr]
+
+    def copy(self):
+        return self.fromcolumns({attr: self.columns[attr].copy() for attr in self.columns})
+
+    def nbytes(self):
+        return sum(self.columns[attr].nbytes for attr in self.columns)
+
+    def get(self, attr, row):
+        if attr not in self.columns: raise AttributeError(attr)
+        column = self.columns[attr]
+        if np.ndim(column) == 1: return column[row]
+        length = self.columns[self.lengthkey(attr)][row]
+        values = column[row].tolist()
+        return values[0] if length < 0 else tuple(values[:length])
+
+    def set(self, attr, row, value):
+        if attr not in self.columns: raise AttributeError(attr)
+        column = self.columns[attr]
+        if np.ndim(column) > 1:
+            value, self.columns[self.lengthkey(attr)][row] = self._row(attr, column.dtype, np.shape(column)[1], value)
+        elif column.dtype.kind == 'U' and len(value) > column.dtype.itemsize // 4:
+            column = self.columns[attr] = column.astype('U{}'.format(len(value)))
+        column[row] = value
+        self.dirty = True
+
+    def __len__(self):
+        return np.size(self.columns['num'])
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __contains__(self, label):
+        return isinstance(label, (int, np.integer)) and 0 <= label < len(self)
+
+    def __getitem__(self, label):
+        if label not in self: raise KeyError(label)
+        return PeakView(self, int(label))
+
+    def keys(self):
+        return range(len(self))
+
+    def values(self):
+        return [PeakView(self, i) for i in self]
+
+    def items(self):
+        return [(i, PeakView(self, i)) for i in self]
+
+    def __repr__(self):
+        return '<PeakTable of {} peaks>'.format(len(self))
+
+class PeakView:
+    """A row of a PeakTable, with the attributes of a Peak: reading or setting one reads or sets the table."""
+    __slots__ = ('table', 'row')
+    kind = 'peak'
+
+    def __init__(self, table, row):
+        object.__setattr__(self, 'table', table)
+        object.__setattr__(self, 'row', row)
+
+    def __getattr__(self, attr):
+        if attr in PeakView.__slots__: raise AttributeError(attr)
+        return self.table.get(attr, self.row)
+
+    def __setattr__(self, attr, value):
+        self.table.set(attr, self.row, value)
+
+    def __reduce__(self):
+        return (PeakView, (self.table, self.row))
+
+    def __repr__(self):
+        return '<Peak #{} of {}>'.format(self.row, self.fullname)
+
     pick = func.pick
\ No newline at end of file
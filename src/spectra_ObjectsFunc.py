@@ -15,7 +15,7 @@ from . import spectra_Plotters as plotter
 from . import spectra_Finders as finder
 from .spectra_InitSettings import cf, peakattr, err
 
-def definepeak(self,npeak,prange,params):
+def definepeak(self,npeak,prange,params,outcome=None):
     """Given an Data instance, defines the npeak-th peak in x position.
     How it works:
         - prange defines the neighbourhood we are interested in.
@@ -42,6 +42,8 @@ def definepeak(self,npeak,prange,params):
             -dboxes
             -maxouterslope
             -slopedrop
+        - outcome: if given, what definepeaks found for this peak: either the outputs below or the Exception
+            to be raised and reported.
     outputs:
         - outp_e: tuple: (float, float)
             x boundary values
@@ -58,6 +60,9 @@ def definepeak(self,npeak,prange,params):
     Warning: In case of error, when one or both of the peak boundaries aren't defined, same thing is returned,
                 only filled with zeros."""
     try:
+        if isinstance(outcome, Exception): raise outcome
+        if outcome is not None: return outcome
+
         #Center and redder (reduced derivative), i.e. smoothed derivative in a neighbourhood defined by prange
         center = self.mai[npeak]
         redder = self.sder[center-prange:center+prange+1]
@@ -101,6 +106,130 @@ def definepeak(self,npeak,prange,params):
         err.add(e,'definepeak',self.fullname,npeak)
         return (0.,0.), (0,0), (0.,0.), (0,0)
 
+def definepeaks(self,pranges,params):
+    """Finds the boundaries of many peaks of an instance at once, exactly as definepeak does one at a time
+    (see its docstrings). Every step is done for all the peaks in the same array operations:
+        - The outerslope: FitBoxes is monotonic, so the fit of the sorted window is sorted and the histogram
+            peak is the longest run of equal values. Each window is sorted once for all the box densities.
+        - The walk in each direction: the first point where the derivative starts decreasing (increasing)
+            locks it, and the first point from there that fulfills condition 1 or 2 is the boundary.
+    inputs:
+        - self: an instance of Isotope, Element or Compound.
+        - pranges: dictionary of ranked peak positions (x) as keys and their pranges as values.
+        - params: same as definepeak.
+    outputs:
+        - dictionary of ranked peak positions as keys and, as values, either the outputs of definepeak or the
+            Exception it raises, ready to be passed to it as outcome.
+    Warning: peaks whose neighbourhood reaches the ends of the derivative or holds non-finite values (in the
+        derivatives or in the box fits) aren't given back. They must be defined by definepeak itself."""
+    der, sder = self.der, self.sder
+    nder = np.size(sder)
+    npeaks, centers, pr = [], [], []
+    for npeak in pranges:
+        prange = pranges[npeak]
+        if not isinstance(prange, (int, np.integer)) or isinstance(prange, bool) or prange < 0: continue
+        center = self.mai[npeak]
+        if center-prange-1 < 0 or center+prange+1 > nder-1: continue
+        npeaks.append(npeak)
+        centers.append(center)
+        pr.append(prange)
+    if npeaks == []: return dict()
+    c, p = np.array(centers, dtype=np.int64), np.array(pr, dtype=np.int64)
+
+    # Peaks are grouped by the size of their neighbourhood, so that none of them is padded over twice its size.
+    valid, nonstanding = np.zeros(np.size(c), dtype=bool), np.zeros((2,np.size(c)), dtype=bool)
+    bounds, reasons = np.zeros((2,np.size(c)), dtype=np.int64), np.zeros((2,np.size(c)), dtype=np.int64)
+    outerslope, zeroed, boxwidth = np.zeros(np.size(c)), np.zeros(np.size(c), dtype=bool), np.zeros(np.size(c))
+    groups = np.ceil(np.log2(p+1)).astype(np.int64)
+    for group in np.unique(groups):
+        g = np.flatnonzero(groups == group)
+        valid[g], nonstanding[:,g], bounds[:,g], reasons[:,g], outerslope[g], zeroed[g], boxwidth[g] = \
+            _definepeaks(der, sder, c[g], p[g], params)
+
+    outcomes = dict()
+    for r in np.flatnonzero(valid):
+        prange = pranges[npeaks[r]]
+        if nonstanding[0][r] or nonstanding[1][r]:
+            outcomes[npeaks[r]] = Exception('Non-standing slope',prange)
+        elif bounds[0][r] < 0 or bounds[1][r] < 0:
+            outcomes[npeaks[r]] = Exception('Unable to Define Peak',prange)
+        else:
+            outp_i = (int(bounds[0][r]), int(bounds[1][r]))
+            outp_e = (self.spectrum[0,outp_i[0]], self.spectrum[0,outp_i[1]])
+            if outp_e[0] == outp_e[1]:
+                outcomes[npeaks[r]] = Exception('Zero-width peak',prange)
+            else:
+                outcomes[npeaks[r]] = (outp_e, outp_i, (0 if zeroed[r] else outerslope[r], boxwidth[r]),
+                                       (int(reasons[0][r]), int(reasons[1][r])))
+    return outcomes
+
+def _definepeaks(der,sder,c,p,params):
+    """Array pass of definepeaks over peaks with centers c and pranges p (see definepeaks).
+    outputs:
+        - valid, nonstanding (left, right), bounds (left, right: -1 if not found), reasons (left, right),
+            outerslope, zeroed (outerslope set to 0) and boxwidth. Every one of them has a column per peak."""
+    nder = np.size(sder)
+    pmax = np.max(p)
+    rows = np.arange(np.size(c))
+
+    # Derivatives in the neighbourhood (prange plus the next point on each side) must be finite.
+    near = np.arange(-pmax-1, pmax+2)
+    inear = np.clip(c[:,None]+near, 0, nder-1)
+    valid = np.all(np.isfinite(der[inear]) & np.isfinite(sder[inear]) | (np.abs(near) > p[:,None]+1), axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        # Outerslope. Padding (inf) is sorted to the end of every window.
+        inwin = np.abs(near[1:-1]) <= p[:,None]
+        redder = np.sort(np.where(inwin, sder[inear[:,1:-1]], np.inf), axis=1)
+        length = 2*p+1
+        b0, b1 = redder[:,0], redder[rows,length-1]
+        valid &= b1 > b0
+        pos = np.arange(np.shape(redder)[1])
+        outerslope, boxwidth = np.zeros(np.size(c)), np.zeros(np.size(c))
+        left = rows
+        for i in range(1,10):
+            # Only the peaks whose histogram hasn't got a peak yet
+            nboxes = params['dboxes']*i*(b1[left]-b0[left])
+            norm = (redder[left]-b0[left,None])/(b1[left]-b0[left])[:,None]
+            fitn = np.around(norm*(nboxes-1)[:,None])/(nboxes-1)[:,None]
+            fit = (b1[left]-b0[left])[:,None]*fitn+b0[left,None]
+            inlen = pos < length[left,None]
+            valid[left] &= np.all(np.isfinite(fit) | ~inlen, axis=1) & np.isfinite(nboxes)
+            # Run lengths of equal values (the longest, the first one on ties as np.argmax does)
+            newrun = np.ones(np.shape(fit), dtype=bool)
+            newrun[:,1:] = fit[:,1:] != fit[:,:-1]
+            newrun &= inlen
+            starts = np.where(newrun, pos, np.size(pos))
+            nextstart = np.hstack((np.minimum.accumulate(starts[:,::-1], axis=1)[:,::-1][:,1:], np.full((np.size(left),1), np.size(pos))))
+            runs = np.where(newrun, np.minimum(nextstart, length[left,None]) - pos, 0)
+            irun = np.argmax(runs, axis=1)
+            outerslope[left] = fit[np.arange(np.size(left)),irun]
+            boxwidth[left] = (b1[left]-b0[left])/(2*nboxes)
+            left = left[runs[np.arange(np.size(left)),irun] == 1]
+            if np.size(left) == 0: break
+        zeroed = np.abs(outerslope) > params['maxouterslope']
+        slope = np.where(zeroed, 0., outerslope)
+
+        # Walks
+        t = np.arange(pmax+1)
+        inrange = t <= p[:,None]
+        bounds, reasons, nonstanding = [], [], []
+        for sign in [-1,1]:
+            ind = np.clip(c[:,None]+sign*t, 0, nder-1)
+            here, further = sder[ind], sder[np.clip(ind+sign, 0, nder-1)]
+            trigger = ((further < here) if sign == -1 else (further > here)) & inrange
+            locked = np.any(trigger, axis=1)
+            ilock = np.argmax(trigger, axis=1)
+            dermax = here[rows,ilock]
+            nonstanding.append(locked & (dermax == slope))
+            cond1 = np.abs((der[ind]-slope[:,None])/(dermax-slope)[:,None]) <= params['slopedrop']
+            cond2 = further*here <= 0
+            stop = (cond1 | cond2) & inrange & (t >= ilock[:,None]) & locked[:,None]
+            istop = np.argmax(stop, axis=1)
+            bounds.append(np.where(np.any(stop, axis=1), c+sign*istop, -1))
+            reasons.append(np.where(cond1[rows,istop], 1, 2))
+    return valid, nonstanding, bounds, reasons, outerslope, zeroed, boxwidth
+
 def Integrate(array,iedges):
     """Integrates an x-y array between two given indices with simpson, and subtracting the background
     assuming a trapezoid.
@@ -138,7 +267,79 @@ def Fwhm(array,ic,coords,ilims):
     xhm2 = array[0,iredhm2+ic] if not iredhm2 is None else None
     return xhm2 - xhm1 if (( not xhm1 is None ) and (not xhm2 is None)) else 0
 
-def computepeak(self,peakpos,prange,params,setx=None):
+def Segments(starts,lengths):
+    """Indices of many consecutive segments of an array, one after the other, and the offset of each segment."""
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(np.sum(lengths)), offsets
+
+def FirstHalfMax(y,starts,lengths,yhm,right):
+    """For many segments of y, does what InBetween(segment, yhm, True) does for each of them, as Fwhm uses it:
+    the first occurrence of yhm if there's one. Otherwise, the first pair of consecutive points that 'sandwich'
+    it: its first (right=False) or second (right=True) point. Indices are absolute, -1 if none (empty segments included)."""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    out = np.full(np.size(lengths), -1, dtype=np.int64)
+    # Empty segments (e.g. a peak whose left boundary is its center) have nothing to find, and reduceat can't skip them.
+    full = lengths > 0
+    if not np.any(full): return out
+    starts, lengths = np.asarray(starts, dtype=np.int64)[full], lengths[full]
+    ind, offsets = Segments(starts, lengths)
+    pos = np.arange(np.size(ind))
+    vals = np.repeat(np.broadcast_to(yhm, np.shape(full))[full], lengths)
+    ylow, yup = y[ind], y[np.minimum(ind+1, np.size(y)-1)]
+    # Pairs must be within the segment: the last point of a segment has no pair.
+    inner = np.ones(np.size(ind), dtype=bool)
+    inner[offsets + lengths - 1] = False
+    exact = ylow == vals
+    sandwich = ((vals > ylow) & (vals < yup) | (vals < ylow) & (vals > yup)) & inner
+    end = np.size(ind)
+    iexact = np.minimum.reduceat(np.where(exact, pos, end), offsets)
+    isandwich = np.minimum.reduceat(np.where(sandwich, pos, end), offsets)
+    first = np.where(iexact < end, iexact, isandwich)
+    found = first < end
+    out[full] = np.where(found, ind[np.minimum(first, end-1)] + np.where(iexact < end, 0, int(right)), -1)
+    return out
+
+def peakvalues(self,peakposes,ilims):
+    """Computes the integrals and FWHM of many peaks at once, as computepeak does (with Integrate and Fwhm).
+    Integrals are taken from integral indices of the spectra, built once for all the peaks and not kept (see
+    Substance.integrate).
+    inputs:
+        - self: an instance of Isotope, Element or Compound.
+        - peakposes: array of ranked peak positions (x).
+        - ilims: (2,n) array with the peak boundaries (indices).
+    outputs:
+        - dictionary of ranked peak positions as keys and tuples (integral, integral_tof, fwhm) as values."""
+    peakposes = np.asarray(peakposes, dtype=np.int64)
+    if np.size(peakposes) == 0: return dict()
+    i0, i1 = np.asarray(ilims[0], dtype=np.int64), np.asarray(ilims[1], dtype=np.int64)
+    integral = self.integrate((i0, i1))
+    integral_tof = -self.integrate((i0, i1), 'spectrum_tof')
+
+    # FWHM: first crossing of the half maximum from the left boundary to the center, and from the center on.
+    ic = np.asarray(self.mai, dtype=np.int64)[peakposes]
+    yhm = self.ma[1,peakposes]/2
+    ihm1 = FirstHalfMax(self.spectrum[1], i0, ic-i0, yhm, False)
+    ihm2 = FirstHalfMax(self.spectrum[1], ic, i1+1-ic, yhm, True)
+    fwhm = self.spectrum[0,ihm2] - self.spectrum[0,ihm1]
+    return {peakposes[k]: (integral[k], integral_tof[k], fwhm[k] if ihm1[k] >= 0 and ihm2[k] >= 0 else 0) for k in range(np.size(peakposes))}
+
+def peakstof(self,peaks):
+    """Computes again the ToF attributes of the peaks of an instance of Data (center_tof, coords_tof and integral_tof)
+    with the current flight paths, as computepeak does.
+    inputs:
+        - self: an instance of Isotope, Element or Compound.
+        - peaks: PeakTable of its peaks.
+    outputs:
+        - a copy of the PeakTable, with its ToF attributes up to date."""
+    peaks = peaks.copy()
+    peaks.column('center_tof')[:] = basic.E2t(peaks.column('center'), self.mode)
+    peaks.column('coords_tof')[:,0] = basic.E2t(peaks.column('coords')[:,0])
+    bounded = np.flatnonzero(np.any(peaks.column('xlims') != 0., axis=1))
+    if np.size(bounded) > 0:
+        peaks.column('integral_tof')[bounded] = -self.integrate(peaks.column('ilims')[bounded].T, 'spectrum_tof')
+    return peaks
+
+def computepeak(self,peakpos,prange,params,setx=None,outcome=None,values=None):
     """Computes every peak parameter, sets up the tuple of them, and creates the
     actual peak instance. For more info on this parameters go to the peakattr documentation.
     inputs:
@@ -147,6 +348,8 @@ def computepeak(self,peakpos,prange,params,setx=None):
         - prange: prange
         - params: parameters
         - setx: tuple with the peak boundaries. Used for the peak editing tool.
+        - outcome: what definepeaks found for this peak, if it did (see definepeak).
+        - values: integral, integral_tof and fwhm of this peak, if peakvalues computed them.
     outputs:
         - Peak instance."""
         
@@ -161,7 +364,7 @@ def computepeak(self,peakpos,prange,params,setx=None):
 
         # If setx is None, we are computing. Otherwise, we com from the editing function.
         if setx is None:
-            xlims,ilims,outerslope,peakreason = definepeak(self,peakpos,prange,params)
+            xlims,ilims,outerslope,peakreason = definepeak(self,peakpos,prange,params,outcome)
             user_edited = False
         else:
             xlims = tuple(setx)
@@ -170,13 +373,16 @@ def computepeak(self,peakpos,prange,params,setx=None):
             peakreason = (3, 3)
             user_edited = True
         successful = True if xlims != (0.,0.) else False
-        integral = Integrate(self.spectrum,ilims) if successful else 0
-        #integral_tof0 = integral*dE2dt(1,center,self.mode) if successful else 0
-        integral_tof = -Integrate(self.spectrum_tof,ilims) if successful else 0
+        if successful and values is not None:
+            integral, integral_tof, fwhm = values
+        else:
+            integral = self.integrate(ilims) if successful else 0
+            #integral_tof0 = integral*dE2dt(1,center,self.mode) if successful else 0
+            integral_tof = -self.integrate(ilims,'spectrum_tof') if successful else 0
+            fwhm = Fwhm(self.spectrum,icenter,coords,ilims) if successful else 0
         yvals = tuple(self.spectrum[1,ilims]) if successful else 0
         width = xlims[1]-xlims[0] if successful else -1
         height = self.ma[1,peakpos]-(yvals[1]+yvals[0])/2 if successful else -1
-        fwhm = Fwhm(self.spectrum,icenter,coords,ilims) if successful else 0
         #Keep calm: big tuple.
         #Rank entries are set to -1 to show that are still unknown.
         #0 values are stored for computation problems, e.g. properties of unbounded peak.
@@ -217,6 +423,27 @@ def computepeak(self,peakpos,prange,params,setx=None):
         return Peak(info)
 
 
+def derivatives(arr,maxleftslope,itersmooth):
+    """Computes the derivative of a spectrum and its smoothed version.
+    At the outermost left, where the derivative is negative, the points whose slope is steeper than
+    maxleftslope are set to 0.
+    inputs:
+        - arr: array (horizontal) with the x-y values
+        - maxleftslope: float
+        - itersmooth: int
+            smoothing iterations for the smoothed derivative.
+    output:
+        - der: array 1-d with the derivative
+        - sder: array 1-d with the smoothed derivative"""
+    der = np.diff(arr[1])/np.diff(arr[0])
+    # First point where the derivative isn't negative (nan isn't negative either)
+    nonneg = np.flatnonzero(~(der<0))
+    if np.size(nonneg) == 0: raise IndexError('derivatives: the derivative is negative everywhere')
+    i0 = nonneg[0]
+    target = np.hstack((np.ones((i0)),np.zeros((np.size(der)-i0))))
+    der = der*(np.int64(np.abs(der)<maxleftslope)*target + (1-target))
+    return der, basic.Smooth(der,itersmooth)
+
 def maxima(arr,xbounds=None,ybounds=None,smoothing=0):
     """Looks for local maxima in the array, restricted to the bounds set.
     input:
@@ -258,6 +485,48 @@ def minima(arr,xbounds=None,ybounds=None,smoothing=0):
     iminima = basic.GetIndex(arr[0],cminima[0],False)
     return cminima,iminima
 
+def peakrange(self,i,params):
+    """prange of the i-th peak (in position). See definepeak."""
+    # Number of points at the left of the current peak
+    nleft = self.mai[i]
+    # Number of points at the right of the current peak
+    nright = np.shape(self.spectrum)[1] - self.mai[i] - 1
+
+    if np.size(self.mai) > 1:
+        # If it's the first or last peak, take as prange the minimum between prangemax, and
+        # number of points to the left and to the right
+        if i == 0:
+            prange = min(params['prangemax'], nleft, nright)
+        elif i == np.size(self.mai)-1:
+            prange = min(params['prangemax'], nleft, nright)
+        # If it's in between, add in the minimum the number of points between the next and the previous point
+        else:
+            prange = min(params['prangemax'],self.mai[i+1]-self.mai[i-1],nleft,nright)
+    elif np.size(self.mai) == 1:
+        prange = min(self.mai[0]-1,np.shape(self.spectrum[1])-self.mai[-1]-1,params['prangemax'])
+    else:
+        prange = 0
+    return prange
+
+def propsedited(self,params,setx):
+    """Computes again only the edited peaks of an instance of Data, and ranks them in with the others (see
+    rerank). The peaks that haven't been edited are kept as they are.
+    inputs:
+        - self: instance
+        - params: dictionary with needed settings.
+        - setx: dictionary of peak position ranks as keys and tuples with bounds as values (see propsisot).
+    outputs:
+        - PeakTable of sorted peaks."""
+    positions = self.peaks.column('center_')
+    edited = [label for label in self.peaks if positions[label] in setx]
+    peaks = []
+    for i in setx:
+        try:
+            peaks.append(computepeak(self,i,peakrange(self,i,params),params,setx[i]))
+        except Exception as e:
+            err.add(e,'propsedited',self.fullname,i)
+    return rerank(self.peaks, removed=edited, added=peaks)
+
 def propsisot(self,params,setx=dict()):
     """Computes all the peaks for a given instance of Data.
     inputs:
@@ -270,68 +539,114 @@ def propsisot(self,params,setx=dict()):
     outputs:
         - sorted dictionary of peaks."""
     peaks_pos = {}
+    pranges = {}
     for i in range(np.size(self.mai)):
         try:
-            # Number of points at the left of the current peak
-            nleft = self.mai[i]
-            # Number of points at the right of the current peak
-            nright = np.shape(self.spectrum)[1] - self.mai[i] - 1
-            
-            if np.size(self.mai) > 1:
-                # If it's the first or last peak, take as prange the minimum between prangemax, and
-                # number of points to the left and to the right
-                if i == 0:
-                    prange = min(params['prangemax'], nleft, nright)
-                elif i == np.size(self.mai)-1:
-                    prange = min(params['prangemax'], nleft, nright)
-                # If it's in between, add in the minimum the number of points between the next and the previous point
-                else:
-                    prange = min(params['prangemax'],self.mai[i+1]-self.mai[i-1],nleft,nright)
-            elif np.size(self.mai) == 1:
-                prange = min(self.mai[0]-1,np.shape(self.spectrum[1])-self.mai[-1]-1,params['prangemax'])
-            else:
-                prange = 0
-            peaks_pos[i] = computepeak(self,i,prange,params,setx.get(i))
+            pranges[i] = peakrange(self,i,params)
+        except Exception as e:
+            # Reported below, in its turn
+            pranges[i] = e
+
+    # The boundaries of every peak are found at once. Then the peaks are computed one by one.
+    # So are their integrals and FWHM (of those that are bounded).
+    outcomes = definepeaks(self, {i: pranges[i] for i in pranges if not isinstance(pranges[i], Exception) and setx.get(i) is None}, params)
+    bounded = [i for i in outcomes if isinstance(outcomes[i], tuple)]
+    try:
+        values = peakvalues(self, bounded, np.array([outcomes[i][1] for i in bounded], dtype=np.int64).reshape(-1,2).T)
+    except Exception:
+        # Then computepeak computes them peak by peak, and reports what fails in its turn.
+        values = dict()
+    for i in range(np.size(self.mai)):
+        try:
+            if isinstance(pranges[i], Exception): raise pranges[i]
+            peaks_pos[i] = computepeak(self,i,pranges[i],params,setx.get(i),outcomes.get(i),values.get(i))
         except Exception as e:
             err.add(e,'propsisot',self.fullname,i)
             continue
-
     return sorting(peaks_pos)
         
+# Peak attributes that are ranked (from the highest value, rank 0, to the lowest), each one in <attribute>_.
+ranked = ('integral', 'width', 'height', 'fwhm', 'ahh', 'ahw')
+
+def rankvalues(peaks):
+    """Array where each row corresponds to a ranked attribute and each column to a peak of a PeakTable."""
+    return np.array([peaks.column(attr) for attr in ranked], dtype=float).reshape(len(ranked), len(peaks))
+
+def setranks(peaks,ranks):
+    """Sets the ranks (array with a row per ranked attribute) of the peaks of a PeakTable, and labels them by integral rank.
+    outputs:
+        - PeakTable of the peaks, label-ranked by intensity."""
+    for attr, row in zip(ranked, ranks):
+        peaks.column(attr + '_')[:] = row
+    peaks.column('num')[:] = ranks[0]
+    bylabel = np.empty(len(peaks), dtype=np.int64)
+    bylabel[ranks[0]] = np.arange(len(peaks))
+    return peaks.take(bylabel)
+
 def sorting(inp):
     """Function that ranks the rankable parameters, and orders the peaks so that they become label-ranked by intensity.
     input:
-        -inp: dictionary of unsorted peaks.
+        -inp: dictionary of unsorted peaks, or PeakTable.
     output:
-        - dictionary of sorted peaks with rank parameters set and ready."""
+        - PeakTable of sorted peaks with rank parameters set and ready."""
+    from .spectra_Objects import PeakTable
 
-    peaks = list(inp.values())
+    peaks = inp if isinstance(inp, PeakTable) else PeakTable(inp.values())
 
-    #Build and array where each column correspond to an instance and each row to a property.
-    array = np.empty((6,0))
-    for el in peaks:
-        array = np.append(array, np.array([el.integral, el.width, el.height, el.fwhm, el.ahh, el.ahw]).reshape(6,1),axis=1)
-    
-    #Index i points at the position in peaks whose rank is the #i
-    integral_sorting = (-array).argsort()[0]
-    #For each row (parameter): index i gives the #rank that peak position i has.
-    ranks = (-array).argsort().argsort()
+    #Array where each column correspond to an instance and each row to a property.
+    array = rankvalues(peaks)
+
+    #For each row (parameter): index i points at the position in peaks whose rank is the #i
+    order = (-array).argsort()
+    #For each row (parameter): index i gives the #rank that peak position i has (inverse permutation of order).
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.broadcast_to(np.arange(len(peaks)), np.shape(order)), axis=1)
 
 #   Alternative (probably faster) method (problem: within same integral val., order is backwards in peak position):
 #   integral_sorting = np.flip(array.argsort(),axis=1)[0]
 #   ranks = np.flip(array.argsort(),axis=1).argsort()
-    
-    for el in range(len(peaks)):
-        peaks[el].integral_ = ranks[0,el]
-        peaks[el].width_ = ranks[1,el]
-        peaks[el].height_ = ranks[2,el]
-        peaks[el].fwhm_ = ranks[3,el]
-        peaks[el].ahh_ = ranks[4,el]
-        peaks[el].ahw_ = ranks[5,el]
-        peaks[el].num = peaks[el].integral_
-    
-    #Build and return the new dictionary of peaks.
-    return {i: peaks[integral_sorting[i]] for i in range(len(peaks))}
+
+    return setranks(peaks, ranks)
+
+def rerank(inp,removed=(),added=()):
+    """Ranks again a PeakTable of sorted peaks after taking some out and/or putting some in, merging instead of
+    sorting all of them again: the peaks that stay keep their order (ties included) and only the added ones are sorted.
+    inputs:
+        - inp: PeakTable of sorted peaks (output of sorting).
+        - removed: labels of the peaks to take out.
+        - added: (unranked) peaks to put in, as a PeakTable or a list of peaks.
+    output:
+        - PeakTable of sorted peaks with rank parameters set and ready."""
+    from .spectra_Objects import PeakTable
+
+    keep = np.ones(len(inp), dtype=bool)
+    keep[[i for i in set(removed) if i in inp]] = False
+    kept = inp.take(keep)
+    added = added if isinstance(added, PeakTable) else PeakTable(added)
+    nkept, nadded = len(kept), len(added)
+    if nkept == 0: return sorting(added)
+
+    oldranks = np.array([kept.column(attr + '_') for attr in ranked], dtype=np.int64)
+    goneranks = np.sort(np.array([inp.column(attr + '_')[~keep] for attr in ranked], dtype=np.int64), axis=1)
+    # Values are only needed to merge the added peaks in.
+    values = rankvalues(kept) if nadded else None
+    newvalues = rankvalues(added)
+    ranks = np.empty((len(ranked), nkept + nadded), dtype=np.int64)
+    positions = np.arange(nkept)
+    for row in range(len(ranked)):
+        # Ranks of the kept peaks among themselves: old rank minus the removed peaks that were ahead of them.
+        keptranks = oldranks[row] - np.searchsorted(goneranks[row], oldranks[row])
+        if not nadded:
+            ranks[row] = keptranks
+            continue
+        order = np.empty(nkept, dtype=np.int64)
+        order[keptranks] = positions
+        # Merging: added values go after the kept ones that are equal to them.
+        neworder = (-newvalues[row]).argsort()
+        inserts = np.searchsorted(-values[row, order], -newvalues[row, neworder], side='right')
+        ranks[row, :nkept] = keptranks + np.searchsorted(inserts, keptranks, side='right')
+        ranks[row, nkept + neworder] = inserts + np.arange(nadded)
+    return setranks(PeakTable.concat([kept, added]), ranks)
 
 def sampprocess(self):
     """It is a method.
@@ -374,17 +689,12 @@ def sampprocess(self):
         err.add(e,'sampprocess',self.fullname,-1)
 
 
-def RankNearest(Dict,xx):
-    closest_peak = np.empty((0,3))
-    for isotname in Dict:
-        isot = Dict[isotname]
-        dist = np.abs(isot.get_from_peaks('center_tof')-xx)
-        if np.size(dist) == 0: continue
-        closest_dist = np.min(dist)
-        nisot = np.argwhere(dist == closest_dist)[0,0]
-        closest_peak = np.append(closest_peak, np.array([isot, closest_dist, nisot]).reshape(1,-1), axis=0)
-    closest_isot = closest_peak[np.argsort(closest_peak[:,1])]
-    return closest_isot
+def RankNearest(Dict,xx,index=None):
+    """For every substance of Dict, its peak closest to xx: array with a row per substance (substance, distance,
+    label), closest first. index is a PeakIndex that has them (see Catalog.peakindex), if there is one."""
+    from .spectra_Objects import PeakIndex
+    if index is None: index = PeakIndex(Dict)
+    return index.closest(xx, Dict)
 
 
 def MatchPeaks(self,distmax=cf.max_match,samp=None):
@@ -397,14 +707,48 @@ def MatchPeaks(self,distmax=cf.max_match,samp=None):
             ind = AskPeak(np.size(samp.ma_tof[0]))
             if ind == -2: break
             xx = samp.ma_tof[0,ind]
-            closest_isot = RankNearest(self.Datas(samp.mode), xx)
-            closest_isot = closest_isot[np.where(closest_isot[:,1]<distmax)[0]]
+            closest_isot = self.peakindex(samp.mode).closest(xx, distmax=distmax)
             for i in range(len(closest_isot)):
                 print('{:3d}: {:>20s} ({:>4d} - {:6.3f})'.format(i, closest_isot[i][0].fullname, closest_isot[i][2], closest_isot[i][1]))
     except Exception as e:
         err.add(e,'MatchPeaks','',-1)
 
 
+def MatchAll(self,samples=None,distmax=None):
+    """Matches every maximum (ma_tof) of some samples against the peaks of every Data of their mode, without asking
+    anything: for each maximum, the closest peak of every Data that is closer than distmax, ranked by distance
+    (as MatchPeaks does for one maximum). Samples of the same mode are matched all at once (see PeakIndex.matches).
+    inputs:
+        - self: Catalog instance.
+        - samples: list of Sample instances or names (all the samples of the catalog if None).
+        - distmax: float
+            tolerance, in us (cf.max_match if None).
+    outputs:
+        - structured array with a row per candidate: sample name, maximum (its index in ma_tof), tof (of the
+        maximum), substance, label (of its peak), center_tof (of its peak), distance and rank (0: the closest one)."""
+    if distmax is None: distmax = cf.max_match
+    if samples is None: samples = list(self.Samples().values())
+    samples = [self.get(samp) if isinstance(samp, str) else samp for samp in samples]
+    table = []
+    for mode in dict.fromkeys(samp.mode for samp in samples):
+        group = [samp for samp in samples if samp.mode == mode]
+        maxima = [samp.ma_tof[0] for samp in group]
+        xx = np.concatenate(maxima)
+        owner = np.repeat(np.arange(len(group)), [np.size(el) for el in maxima])
+        imax = np.concatenate([np.arange(np.size(el)) for el in maxima])
+        which, names, labels, centers, dist, ranks = self.peakindex(mode).matches(xx, distmax)
+        table.append((np.array([samp.fullname for samp in group], dtype=object)[owner[which]], imax[which], xx[which],
+                      names, labels, centers, dist, ranks))
+    columns = [np.concatenate([el[i] for el in table]) if table else np.empty(0) for i in range(8)]
+    width = lambda column: max([len(el) for el in column] + [1])
+    dtype = [('sample', 'U{}'.format(width(columns[0]))), ('maximum', 'i8'), ('tof', 'f8'), ('substance', 'U{}'.format(width(columns[3]))),
+             ('label', 'i8'), ('center_tof', 'f8'), ('distance', 'f8'), ('rank', 'i8')]
+    outp = np.empty(np.size(columns[1]), dtype=dtype)
+    for (name, _), column in zip(dtype, columns):
+        outp[name] = column
+    return outp
+
+
 def AskPeak(firstno):
     p = input('Enter peak: >')
     if p in ['q', 'quit', '']: return -2
@@ -439,10 +783,10 @@ def ComparePeaks(self):
                 print('Invalid input')
                 continue
             xx = samp.ma_tof[0,ind]
-            closest_isot = RankNearest(Dict, xx)
-            newlims = (basic.Closest(samp.spectrum_tof[0], newlims_[0], True), basic.Closest(samp.spectrum_tof[0], newlims_[1], True))
+            closest_isot = RankNearest(Dict, xx, self.peakindex(samp.mode))
+            newlims = tuple(basic.ClosestMany(samp.spectrum_tof[0], newlims_, True))
             print('\tPeak center: {}. Peak newlims: {}'.format(xx, newlims))
-            integral = Integrate(samp.spectrum_tof, newlims) - Integrate(samp.stripped, newlims)
+            integral = samp.integrate(newlims, 'spectrum_tof') - samp.integrate(newlims, 'stripped')
             print('\tClosest component peaks:')
             for i in range(len(closest_isot)):
                 print('\t{}: {} ({})'.format(i, closest_isot[i][0].fullname, closest_isot[i][1]))
@@ -499,7 +843,7 @@ def EditPeaks(self):
             except:
                 print('Invalid input')
                 continue
-            newlims = (basic.Closest(self.spectrum[0], newlims_[0], False), basic.Closest(self.spectrum[0], newlims_[1], False))
+            newlims = tuple(basic.ClosestMany(self.spectrum[0], newlims_, False))
             print('\tNew peak boundaries: {}'.format(newlims))
             plt.axvline(x=newlims[0], color='green')
             plt.axvline(x=newlims[1], color='green')
@@ -541,15 +885,16 @@ def DeletePeaks(self):
 
 
 def pick(self,attr,magn):
-        if attr in self.__dict__ and attr+'_tof' in self.__dict__:
+        # hasattr, not self.__dict__: derived spectra are properties (see Substance.conversions).
+        if hasattr(self,attr) and hasattr(self,attr+'_tof'):
             if magn in [1,True,'ToF','tof','time of flight']:
                 return getattr(self,attr+'_tof')
             else:
                 return getattr(self,attr)
         else:
-            if attr in self.__dict__:
+            if hasattr(self,attr):
                 return getattr(self,attr)
-            elif attr+'_tof' in self.__dict__:
+            elif hasattr(self,attr+'_tof'):
                 return getattr(self,attr+'_tof')
             else:
                 return None
\ No newline at end of file
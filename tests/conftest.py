@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The package is imported as 'spectra' (the name of its directory is irrelevant), in batch mode: no catalog is
+built nor asked for on import.
+"""
+
+import os
+import sys
+import importlib.util
+
+os.environ.setdefault('SPECTRA_BATCH', '1')
+import matplotlib
+matplotlib.use('Agg')
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if 'spectra' not in sys.modules:
+    spec = importlib.util.spec_from_file_location('spectra', os.path.join(root, '__init__.py'), submodule_search_locations=[root])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['spectra'] = module
+    spec.loader.exec_module(module)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from spectra.src import spectra_Basics as basic
+
+
+def same(a, b):
+    return all((x is None and y is None) or (x is not None and y is not None and x == y) for x, y in zip(a, b))
+
+def test_brackets_match_inbetween():
+    rng = np.random.default_rng(0)
+    arr = np.unique(rng.uniform(0, 10, 50))
+    vals = np.concatenate((rng.uniform(-1, 11, 200), arr[::7], [arr[0], arr[-1]]))
+    for axis in (arr, arr[::-1]):
+        for outp_i in (False, True):
+            rows = basic.Brackets(axis, vals, outp_i)
+            for val, row in zip(vals, rows):
+                assert same(row, basic.InBetween(axis, val, outp_i))
+
+def test_closestmany_match_closest():
+    rng = np.random.default_rng(1)
+    arr = np.unique(rng.uniform(0, 10, 50))
+    vals = np.concatenate((rng.uniform(-1, 11, 200), arr[::7]))
+    for axis in (arr, arr[::-1]):
+        for outp_i in (False, True):
+            found = basic.ClosestMany(axis, vals, outp_i)
+            assert same(found, [basic.Closest(axis, val, outp_i) for val in vals])
+
+def test_out_of_range():
+    arr = np.arange(5.)
+    assert basic.Brackets(arr, [2.5, 7], True).tolist() == [[2, 3], [None, None]]
+    assert basic.Brackets(arr, [2.5, 7], True, -1).tolist() == [[2, 3], [-1, -1]]
+    assert basic.Brackets(arr, [2.5], False).dtype == float
+    assert basic.ClosestMany(arr, [-1, 2.2], True).tolist() == [None, 2]
+    assert np.isnan(basic.ClosestMany(arr, [-1], False, np.nan)[0])
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+
+from spectra.src.spectra_Objects import Catalog, Isotope, PeakTable
+from spectra.src.spectra_FileHandlers import ImportFile, ExportProps2, ExportPropsBin, LoadPeaks, LoadPeaksBin
+from spectra.src.spectra_FileHandlers import file_peaks_nonhuman, file_peaks_bin, ssave, sload, PeakCache
+from spectra.src.spectra_InitSettings import cf, paths, peakattr
+
+
+def isotopes():
+    out = dict()
+    for name in ['63-Eu-153_n-g', '29-Cu-63_n-tot']:
+        array = ImportFile(os.path.join(paths.data, name + '.txt'))[0]
+        out[name] = Isotope(name, array)
+    return out
+
+def rows(peaks):
+    return [[getattr(peaks[i], attr) for attr in peakattr.getlist()] for i in sorted(peaks)]
+
+def test_unbounded_yvals_are_scalars():
+    # Cu-63 (n-tot) has an unbounded peak.
+    peaks = [peak for iso in isotopes().values() for peak in iso.peaks.values()]
+    assert any(peak.xlims == (0., 0.) for peak in peaks)
+    for peak in peaks:
+        assert isinstance(peak.yvals, tuple) == (peak.xlims != (0., 0.))
+
+def test_export_and_load_peaks(tmp_path, monkeypatch):
+    monkeypatch.setattr(paths, 'load', str(tmp_path))
+    isots = isotopes()
+    ExportProps2(isots)
+    ExportPropsBin(isots)
+    fromtxt = LoadPeaks(os.path.join(str(tmp_path), file_peaks_nonhuman))
+    frombin = LoadPeaksBin(os.path.join(str(tmp_path), file_peaks_bin))
+    # The end of the text file ('::') is read as an empty substance.
+    assert sorted(name for name in fromtxt if name) == sorted(frombin) == sorted(isots)
+    for name in isots:
+        assert len(fromtxt[name]) == len(frombin[name]) == len(isots[name].peaks)
+        assert rows(frombin[name]) == rows(isots[name].peaks)
+        assert rows(PeakTable.of(fromtxt[name])) == rows(isots[name].peaks)
+
+def test_export_and_load_odd_tuples(tmp_path, monkeypatch):
+    monkeypatch.setattr(paths, 'load', str(tmp_path))
+    isots = isotopes()
+    peaks = isots['29-Cu-63_n-tot'].peaks
+    peaks[0].yvals, peaks[1].yvals, peaks[2].outerslope = (1.5,), 0.25, ()
+    ExportProps2(isots)
+    ExportPropsBin(isots)
+    fromtxt = PeakTable.of(LoadPeaks(os.path.join(str(tmp_path), file_peaks_nonhuman))['29-Cu-63_n-tot'])
+    frombin = LoadPeaksBin(os.path.join(str(tmp_path), file_peaks_bin))['29-Cu-63_n-tot']
+    for table in [fromtxt, frombin]:
+        assert (table[0].yvals, table[1].yvals, table[2].outerslope) == ((1.5,), 0.25, ())
+        assert rows(table) == rows(peaks)
+
+def test_load_bin_without_lengths(tmp_path, monkeypatch):
+    # Files written before the length columns existed: lengths are made up from the nan padding.
+    import numpy as np
+    monkeypatch.setattr(paths, 'load', str(tmp_path))
+    isots = isotopes()
+    ExportPropsBin(isots)
+    filepath = os.path.join(str(tmp_path), file_peaks_bin)
+    with np.load(filepath) as data:
+        columns = {attr: data[attr] for attr in data.files if not attr.endswith('.len')}
+    np.savez(filepath, **columns)
+    frombin = LoadPeaksBin(filepath)
+    for name in isots:
+        assert rows(frombin[name]) == rows(isots[name].peaks)
+
+def test_shards_write_what_changed(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(paths, 'load', str(tmp_path))
+    monkeypatch.setattr(cf, 'use_pickle', True)
+    spcat = Catalog.__new__(Catalog)
+    spcat.volumes = ['isotopes']
+    spcat.isotopes = isotopes()
+    spcat.date_created = spcat.date_modified = ''
+    def written():
+        ssave(spcat)
+        return int(capsys.readouterr().out.split('Catalog saved. ')[1].split()[0])
+    assert written() == 2
+    assert written() == 0
+    # Setting a peak through its view, or an attribute, is a change.
+    spcat.isotopes['63-Eu-153_n-g'].peaks[0].integral = 1.
+    assert written() == 1
+    spcat.isotopes['29-Cu-63_n-tot'].ybounds = 1.
+    assert written() == 1
+    assert written() == 0
+    loaded = sload(lazy=True)
+    assert loaded.lazy is True and sload(lazy=False).lazy is False
+    assert loaded.isotopes['63-Eu-153_n-g'].peaks[0].integral == 1.
+    assert not loaded.isotopes['63-Eu-153_n-g'].dirty
+
+def test_peak_cache_disk_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(cf, 'peak_cache_disk', True)
+    cache = PeakCache(directory=str(tmp_path))
+    table = isotopes()['63-Eu-153_n-g'].peaks
+    files = lambda: sorted(f for f in os.listdir(str(tmp_path)) if f.endswith('.npz'))
+    cache.put('a', table)
+    size = os.path.getsize(os.path.join(str(tmp_path), 'a.npz'))
+    # Room for two files.
+    monkeypatch.setattr(cf, 'peak_cache_mb', 2.5*size / 2**20)
+    os.utime(os.path.join(str(tmp_path), 'a.npz'), (1, 1))
+    cache.put('b', table)
+    os.utime(os.path.join(str(tmp_path), 'b.npz'), (2, 2))
+    cache.put('c', table)
+    assert files() == ['b.npz', 'c.npz']
+    # Reading a file from disk makes it the most recently used.
+    os.utime(os.path.join(str(tmp_path), 'c.npz'), (3, 3))
+    cache.clear()
+    assert cache.get('b') is not None
+    cache.put('d', table)
+    assert files() == ['b.npz', 'd.npz']
+    # The newest file is kept even if it doesn't fit.
+    monkeypatch.setattr(cf, 'peak_cache_mb', 0)
+    cache.put('e', table)
+    assert files() == ['e.npz']
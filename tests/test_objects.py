@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+import pytest
+
+from spectra.src.spectra_Objects import Isotope, Sample
+from spectra.src.spectra_FileHandlers import ImportFile
+from spectra.src.spectra_InitSettings import cf, paths
+
+
+def isotope(name='63-Eu-153_n-g'):
+    return Isotope(name, ImportFile(os.path.join(paths.data, name + '.txt'))[0])
+
+def test_tof_follows_flight_path(monkeypatch):
+    iso = isotope()
+    peaks, ma_tof, spectrum_tof = iso.peaks, iso.ma_tof, iso.spectrum_tof
+    monkeypatch.setattr(cf, 'L0_g', 2*cf.L0_g)
+    # Everything in ToF is twice as much, as if it had been computed with the new flight path.
+    assert np.allclose(iso.spectrum_tof[0], 2*spectrum_tof[0], rtol=1e-14)
+    assert np.allclose(iso.ma_tof[0], 2*ma_tof[0], rtol=1e-14)
+    assert iso.peaks is not peaks
+    fresh = isotope()
+    assert np.array_equal(iso.peaks.column('center_tof'), fresh.peaks.column('center_tof'))
+    assert np.array_equal(iso.peaks.column('coords_tof'), fresh.peaks.column('coords_tof'))
+    assert np.allclose(iso.peaks.column('integral_tof'), fresh.peaks.column('integral_tof'), rtol=1e-9, atol=0)
+    assert np.allclose(iso.peaks.column('center_tof'), 2*peaks.column('center_tof'), rtol=1e-14)
+    # The ToF attributes are computed again only when the flight path changes.
+    assert iso.peaks is iso.peaks
+
+def test_sample_energy_follows_flight_path(monkeypatch):
+    filename = sorted(os.listdir(paths.path('samples_n-g')))[0]
+    samp = Sample(filename, ImportFile(os.path.join(paths.path('samples_n-g'), filename))[0], 'n-g', filename)
+    ma = samp.ma
+    monkeypatch.setattr(cf, 'L0_g', 2*cf.L0_g)
+    assert np.allclose(samp.ma[0], 4*ma[0], rtol=1e-14)
+    assert np.array_equal(samp.ma[1], ma[1])
+
+def test_peaktable_lengths():
+    from spectra.src.spectra_Objects import PeakTable
+    iso = isotope()
+    peaks = iso.peaks
+    peaks[0].outerslope = (np.nan, 1.)
+    peaks[1].outerslope = (1., np.nan)
+    peaks[2].outerslope = (np.nan,)
+    peaks[3].ilims = 7
+    assert np.isnan(peaks[0].outerslope[0]) and peaks[0].outerslope[1] == 1.
+    assert peaks[1].outerslope[0] == 1. and np.isnan(peaks[1].outerslope[1])
+    assert len(peaks[2].outerslope) == 1 and np.isnan(peaks[2].outerslope[0])
+    assert peaks[3].ilims == 7
+    # The lengths go along with the rows.
+    copy = PeakTable.concat([peaks.take([3, 1]), peaks.copy()])
+    assert copy[0].ilims == 7 and len(copy[1].outerslope) == 2 and len(copy[4].outerslope) == 1
+
+def test_peaktable_too_wide():
+    iso = isotope()
+    try:
+        iso.peaks[0].xlims = (1., 2., 3.)
+    except ValueError as e:
+        assert 'xlims' in str(e)
+    else:
+        raise AssertionError('a 3-tuple was set in a 2-wide column')
+
+def test_get_from_peaks_is_a_copy():
+    iso = isotope()
+    integrals = iso.get_from_peaks('integral')
+    integrals[:] = 0
+    assert iso.peaks[0].integral != 0
+
+@pytest.mark.filterwarnings('ignore::DeprecationWarning')
+def test_integralindex_matches_integrate():
+    from spectra.src.spectra_Objects import IntegralIndex
+    from spectra.src.spectra_ObjectsFunc import Integrate
+    import scipy.integrate as spint
+    rng = np.random.default_rng(0)
+    for name in ['92-U-238_n-tot', '63-Eu-153_n-g', '38-Sr-89_n-g', '29-Cu-63_n-tot']:
+        iso = isotope(name)
+        bounded = [iso.peaks[i].ilims for i in iso.peaks if iso.peaks[i].xlims != (0., 0.)]
+        n = np.shape(iso.spectrum)[1]
+        starts = rng.integers(0, n-3, 200)
+        windows = [(i0, i0 + int(rng.integers(1, min(400, n-1-i0)))) for i0 in starts]
+        for spectrum in [iso.spectrum, iso.spectrum_tof]:
+            index = IntegralIndex(spectrum)
+            for i0, i1 in bounded + windows:
+                expected = Integrate(spectrum, (i0, i1))
+                simpson = spint.simps(spectrum[1, i0:i1+1], spectrum[0, i0:i1+1])
+                # As precise as the bigger of the Simpson integral and the background.
+                assert abs(index.integrate(i0, i1) - expected) <= 1e-12*(abs(simpson) + abs(simpson - expected))
+            for i0, i1 in bounded:
+                expected = Integrate(spectrum, (i0, i1))
+                assert abs(index.integrate(i0, i1) - expected) <= 1e-11*abs(expected)
+
+def test_substance_integrate():
+    from spectra.src.spectra_ObjectsFunc import Integrate
+    iso = isotope()
+    ilims = np.array([iso.peaks[i].ilims for i in iso.peaks]).T
+    # A single window is integrated directly, and many at once through an index that isn't kept.
+    assert iso.integrate(tuple(ilims[:,0])) == Integrate(iso.spectrum, tuple(ilims[:,0]))
+    many = iso.integrate(ilims, 'spectrum_tof')
+    assert np.allclose(many, [Integrate(iso.spectrum_tof, tuple(ilims[:,k])) for k in range(np.shape(ilims)[1])], rtol=1e-11, atol=0)
+    assert iso.__dict__.get('_integrals', dict()) == dict()
+    # A kept index is used for every window.
+    index = iso.integrals('spectrum')
+    assert iso.integrals('spectrum') is index
+    assert iso.integrate(tuple(ilims[:,0])) == index.integrate(*ilims[:,0])
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import numpy as np
+
+from spectra.src import spectra_Basics as basic
+from spectra.src.spectra_ObjectsFunc import FirstHalfMax
+
+
+y = np.array([0, 1, 2, 3, 4, 5, 4, 3, 2, 1, 0, 1.])
+
+def test_firsthalfmax_empty_segment_in_the_middle():
+    assert list(FirstHalfMax(y, [0, 5, 7], [5, 0, 4], 2.5, False)) == [2, -1, 7]
+
+def test_firsthalfmax_empty_segment_last_and_first():
+    # A peak whose left boundary is its center gives an empty left side.
+    assert list(FirstHalfMax(y, [0, 5], [5, 0], 2.5, False)) == [2, -1]
+    assert list(FirstHalfMax(y, [5, 0], [0, 5], 2.5, True)) == [-1, 3]
+    assert list(FirstHalfMax(y, [5], [0], 2.5, False)) == [-1]
+
+def test_firsthalfmax_matches_inbetween():
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        arr = rng.integers(0, 6, 40).astype(float)
+        starts = rng.integers(0, 35, 5)
+        lengths = rng.integers(0, 5, 5)
+        yhm = rng.integers(0, 6, 5) + rng.choice([0, .5], 5)
+        for right in (False, True):
+            found = FirstHalfMax(arr, starts, lengths, yhm, right)
+            for k in range(5):
+                i = basic.InBetween(arr[starts[k]:starts[k]+lengths[k]], yhm[k], True)[int(right)]
+                assert found[k] == (-1 if i is None else starts[k] + i)
+
+def test_zero_width_left_side_isotope():
+    # Some peaks of Eu-153 have their left boundary at their center (zero-width left side).
+    from spectra.src.spectra_Objects import Isotope
+    from spectra.src.spectra_FileHandlers import ImportFile
+    from spectra.src.spectra_InitSettings import paths
+    for mode in ['n-g', 'n-tot']:
+        array = ImportFile(os.path.join(paths.data, '63-Eu-153_{}.txt'.format(mode)))[0]
+        iso = Isotope('63-Eu-153_{}'.format(mode), array)
+        assert len(iso.peaks) == 69
+
+def test_propsedited_builds_no_integral_index(monkeypatch):
+    from spectra.src import spectra_Objects
+    from spectra.src.spectra_Objects import Isotope
+    from spectra.src.spectra_FileHandlers import ImportFile
+    from spectra.src.spectra_ObjectsFunc import propsedited, Integrate
+    from spectra.src.spectra_InitSettings import cf, paths
+    iso = Isotope('63-Eu-153_n-g', ImportFile(os.path.join(paths.data, '63-Eu-153_n-g.txt'))[0])
+    peak = iso.peaks[0]
+    setx = {int(peak.center_): (iso.spectrum[0, peak.ilims[0]-1], iso.spectrum[0, peak.ilims[1]+1])}
+
+    # The edited windows are integrated directly, in the time of the window.
+    def built(self, array): raise AssertionError('IntegralIndex built on an edit')
+    monkeypatch.setattr(spectra_Objects.IntegralIndex, '__init__', built)
+    peaks = propsedited(iso, cf.pack(), setx)
+    assert len(peaks) == len(iso.peaks)
+    edited = [peaks[i] for i in peaks if peaks[i].user_edited]
+    assert len(edited) == 1
+    assert edited[0].integral == Integrate(iso.spectrum, edited[0].ilims)
+    assert iso.__dict__.get('_integrals', dict()) == dict()